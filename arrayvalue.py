@@ -0,0 +1,210 @@
+import numpy as np
+
+from multivalue import *
+
+# numpy versions of MultiValue operations
+# Reflected methods swap the arguments round
+UNARY_UFUNCS = {
+    "__ceil__": np.ceil,
+    "__floor__": np.floor,
+    "__invert__": np.invert,
+    "__neg__": np.negative,
+    "__pos__": np.positive,
+    "__round__": np.round,
+    "__trunc__": np.trunc,
+}
+BINARY_UFUNCS = {
+    "__add__": np.add,
+    "__eq__": np.equal,
+    "__floordiv__": np.floor_divide,
+    "__ge__": np.greater_equal,
+    "__gt__": np.greater,
+    "__le__": np.less_equal,
+    "__lshift__": np.left_shift,
+    "__lt__": np.less,
+    "__mod__": np.mod,
+    "__mul__": np.multiply,
+    "__ne__": np.not_equal,
+    "__pow__": np.power,
+    "__rshift__": np.right_shift,
+    "__sub__": np.subtract,
+    "__truediv__": np.true_divide,
+    "__xor__": np.bitwise_xor,
+}
+REFLECTED_UFUNCS = {
+    "__radd__": np.add,
+    "__rfloordiv__": np.floor_divide,
+    "__rlshift__": np.left_shift,
+    "__rmod__": np.mod,
+    "__rmul__": np.multiply,
+    "__rpow__": np.power,
+    "__rrshift__": np.right_shift,
+    "__rsub__": np.subtract,
+    "__rtruediv__": np.true_divide,
+    "__rxor__": np.bitwise_xor,
+}
+# numpy treats bools as logical values for arithmetic (True + True is True), but Python treats them as 0 and 1
+# So bools are turned into ints first, for all but these, which give the same results as Python on bools
+BOOL_UFUNCS = {np.equal, np.not_equal, np.greater, np.greater_equal, np.less, np.less_equal, np.bitwise_xor}
+
+# Like Python, these give ints unless given a number of digits
+ROUNDING_UFUNCS = {np.ceil, np.floor, np.round, np.trunc}
+
+def as_numeric(array):
+    """This array, with bools turned into ints."""
+    return array.astype(np.int64) if array.dtype == bool else array
+
+def array_unaries(ufuncs):
+    """Turn these method calls into vectorised calls to return ArrayValues."""
+    def method_wrapper(cls):
+        for method, ufunc in ufuncs.items():
+            def mwrap(self, *args, bound_ufunc=ufunc, **kwargs):
+                out = bound_ufunc(as_numeric(self.array), *args)
+                if bound_ufunc in ROUNDING_UFUNCS and not args and out.dtype.kind == "f":
+                    if not np.isfinite(out).all():
+                        raise ValueError("Cannot convert infinite or nan options to ints.")
+                    out = out.astype(np.int64)
+                return ArrayValue(out, rem_dups=True)
+            setattr(cls, method, mwrap)
+        return cls
+    return method_wrapper
+
+def array_binaries(ufuncs, reflected=False):
+    """Turn these method calls into broadcast calls to return ArrayValues.
+
+Second value can be an ArrayValue, numeric MultiValue or single valued. Multiple valued
+  arguments use the outer product, so get all combinations like MultiValue does."""
+    def method_wrapper(cls):
+        for method, ufunc in ufuncs.items():
+            def mwrap(self, other, bound_ufunc=ufunc):
+                array = self.array if bound_ufunc in BOOL_UFUNCS else as_numeric(self.array)
+                if isinstance(other, MultiValue):
+                    other = as_array_value(other)
+                    if other is None:
+                        return NotImplemented
+                    other_array = other.array if bound_ufunc in BOOL_UFUNCS else as_numeric(other.array)
+                    if reflected:
+                        out = bound_ufunc.outer(other_array, array)
+                    else:
+                        out = bound_ufunc.outer(array, other_array)
+                    return ArrayValue(out.ravel(), rem_dups=True)
+                if not isinstance(other, (int, float, bool, np.number, np.bool_)):
+                    return NotImplemented
+                if bound_ufunc not in BOOL_UFUNCS and isinstance(other, (bool, np.bool_)):
+                    other = int(other)
+                out = bound_ufunc(other, array) if reflected else bound_ufunc(array, other)
+                return ArrayValue(out, rem_dups=True)
+            setattr(cls, method, mwrap)
+        return cls
+    return method_wrapper
+
+@array_unaries(UNARY_UFUNCS)
+@array_binaries(BINARY_UFUNCS)
+@array_binaries(REFLECTED_UFUNCS, reflected=True)
+# Methods deliberately not included: __int__, __float__ (must return a single value)
+#   __contains__ (use 'value in av.array')
+class ArrayValue(MultiValue):
+    """Numeric options backed by a numpy array.
+
+Works for int, float and bool options. Operations are vectorised instead of looping in Python:
+  unary operations act on the whole array, binary operations broadcast with outer products,
+  and duplicates are removed with np.unique.
+Bools act as 0 and 1 in arithmetic, as in Python; e.g. True + True is 2 and ~True is -2.
+Unlike Python, ints are 64 bit, so results too big for that wrap round instead of growing,
+  and dividing by zero gives inf, nan or 0 (with a numpy warning) instead of raising ZeroDivisionError.
+The options are stored in 'array'; the underlying tuple is left empty, so len and iteration are
+  taken from the array instead. Iterating gives Python values, so any() and all() work as usual."""
+    def __new__(cls, iterable=(), rem_dups=False):
+        """Pass in rem_dups=True if there might be duplicates in the values."""
+        ret = tuple.__new__(cls)
+        array = np.asarray(iterable if isinstance(iterable, np.ndarray) else list(iterable))
+        if array.dtype.kind not in "biuf":
+            raise ValueError("ArrayValue only holds ints, floats and bools, not " + str(array.dtype) + ".")
+        array = array.ravel()
+        ret.array = np.unique(array) if rem_dups else array
+        return ret
+
+    def __getnewargs__(self):
+        return (self.array,)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ArrayValue(self.array[i])
+        return self.array[i].item()
+
+    def __hash__(self):
+        return hash(self.array.tobytes())
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+    def __str__(self):
+        return str(tuple(self))
+
+    # Conversion functions
+
+    def to_bool(self, truth_fn=bool):
+        """Return an ArrayValue of the boolean values of these options.
+
+truth_fn: Optional function for deciding truthiness; e.g., >= 2
+  This is tried on the whole array first, and applied value by value if that doesn't work."""
+        return ArrayValue(self._truths(truth_fn), rem_dups=True)
+
+    def _truths(self, truth_fn=bool):
+        """Boolean array of truth values of each option."""
+        if truth_fn is bool:
+            return self.array.astype(bool)
+        try:
+            truths = np.asarray(truth_fn(self.array), dtype=bool)
+            if truths.shape == self.array.shape:
+                return truths
+        except (TypeError, ValueError):
+            pass
+        return np.fromiter((truth_fn(val) for val in self), dtype=bool, count=len(self))
+
+    def _bool_options(self):
+        """(can be True, can be False) for these options."""
+        truths = self._truths()
+        return bool(truths.any()), not bool(truths.all())
+
+    # Optimised boolean combinations; just need which truth values each side can have
+
+    def __or__(self, other):
+        """A MultiValue of all possible boolean | combinations"""
+        return self._combine_bools(other, lambda x, y: x or y)
+
+    def __and__(self, other):
+        """A MultiValue of all possible boolean & combinations"""
+        return self._combine_bools(other, lambda x, y: x and y)
+
+    __ror__ = __or__
+    __rand__ = __and__
+
+    def _combine_bools(self, other, combine):
+        if not len(self):
+            return ArrayValue(np.zeros(0, dtype=bool))
+        mine = bool_options(self)
+        theirs = bool_options(other) if isinstance(other, MultiValue) else (bool(other),)
+        return ArrayValue([combine(x, y) for x in mine for y in theirs], rem_dups=True)
+
+
+def bool_options(value):
+    """Distinct truth values in a MultiValue."""
+    if isinstance(value, ArrayValue):
+        can_true, can_false = value._bool_options()
+        return tuple(truth for truth, can in ((True, can_true), (False, can_false)) if can)
+    return tuple(value.to_bool())
+
+def as_array_value(value):
+    """The ArrayValue form of a MultiValue, or None if it isn't numeric."""
+    if isinstance(value, ArrayValue):
+        return value
+    if all(isinstance(val, (int, float, bool, np.number, np.bool_)) for val in value):
+        return ArrayValue(value)
+    return None
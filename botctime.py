@@ -1,3 +1,7 @@
+import functools
+from bisect import bisect_left
+
+from timeindex import *
 
 
 # Time is represented as a combination of day/night number plus point in day/night order
@@ -26,28 +30,60 @@ MIDDAY = 1
 POST_EX = 2
 DUSK = 0
 
+# Times are packed into a single ordinal int: hour, then minute, then second.
+# Minutes and seconds each get this many bits, so night orders of any practical length fit.
+MINUTE_BITS = 20
+SECOND_BITS = 20
+MINUTE_LIMIT = 1 << MINUTE_BITS
+SECOND_LIMIT = 1 << SECOND_BITS
+HOUR_SHIFT = MINUTE_BITS + SECOND_BITS
+
+# Common day and night points are cached, since they are made a lot
+@functools.lru_cache(maxsize=4096)
 def day(n, minute=DAWN, second=0):
     return BOTCTime(2*(n-1)+1, minute, second)
 
+@functools.lru_cache(maxsize=4096)
 def night(n, minute=DUSK, second=0):
     return BOTCTime(2*(n-1), minute, second)
 
 class BOTCTime:
-    """Time classwith internal representation as a tuple."""
+    """Time class, with internal representation as a single packed int.
+
+The packed ordinal sorts the same way as (hour, minute, second), so comparisons and hashing only
+  look at that int. Hashes don't collide, however long the night order is.
+BOTCTimes are immutable, so the same instance can be shared (e.g. the ones cached by day and night)."""
+    __slots__ = ("ord",)
+
     def __init__(self, hour=0, minute=0, second=0):
-        self.t = (hour, minute, second)
+        if not (0 <= minute < MINUTE_LIMIT and 0 <= second < SECOND_LIMIT):
+            raise ValueError("Minute and second must be between 0 and {}, not {} and {}.".format(
+                MINUTE_LIMIT - 1, minute, second))
+        self.ord = (hour << HOUR_SHIFT) | (minute << SECOND_BITS) | second
+
+    @classmethod
+    def from_ord(cls, ordinal):
+        """Time from its packed ordinal."""
+        ret = object.__new__(cls)
+        ret.ord = ordinal
+        return ret
+
+    @property
+    def t(self):
+        """(hour, minute, second) tuple."""
+        return (self.h, self.m, self.s)
 
     @property
     def h(self):
-        return self.t[0]
+        return self.ord >> HOUR_SHIFT
 
     @property
     def m(self):
-        return self.t[1]
+        return (self.ord >> SECOND_BITS) & (MINUTE_LIMIT - 1)
 
     @property
     def s(self):
-        return self.t[2]
+        return self.ord & (SECOND_LIMIT - 1)
 
     @property
     def day(self):
@@ -61,25 +97,43 @@ class BOTCTime:
     def n(self):
         return (self.h // 2) + 1
 
+    # Anything without an ordinal isn't a time, so let Python handle it
+
     def __eq__(self, other):
-        assert isinstance(other, BOTCTime)
-        return self.t == other.t
+        try:
+            return self.ord == other.ord
+        except AttributeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        try:
+            return self.ord != other.ord
+        except AttributeError:
+            return NotImplemented
 
     def __lt__(self, other):
-        assert isinstance(other, BOTCTime)
-        return self.t < other.t
+        try:
+            return self.ord < other.ord
+        except AttributeError:
+            return NotImplemented
 
     def __gt__(self, other):
-        assert isinstance(other, BOTCTime)
-        return self.t > other.t
+        try:
+            return self.ord > other.ord
+        except AttributeError:
+            return NotImplemented
 
     def __le__(self, other):
-        assert isinstance(other, BOTCTime)
-        return self.t <= other.t
+        try:
+            return self.ord <= other.ord
+        except AttributeError:
+            return NotImplemented
 
     def __ge__(self, other):
-        assert isinstance(other, BOTCTime)
-        return self.t >= other.t
+        try:
+            return self.ord >= other.ord
+        except AttributeError:
+            return NotImplemented
 
     def __add__(self, other):
         if isinstance(other, BOTCTime):
@@ -97,42 +151,91 @@ class BOTCTime:
         return str(self)
 
     def __hash__(self):
-        # Assumption that no more than 60 characters in night order and 10 seconds
-        return self.s + 10*self.m + 6000*self.h
+        return hash(self.ord)
+
+    def __getstate__(self):
+        return self.ord
+
+    def __setstate__(self, state):
+        self.ord = state
 
 
 class Clock:
     def __init__(self, start_time=None):
         self.now = start_time if start_time else night(1)
-        self.moments = [self.now]
+        self.moments = [self.now] # In the order they were seen, including any rewinds
+        # Distinct moments in time order, and their ordinals for bisecting
+        self._sorted = [self.now]
+        self._ords = [self.now.ord]
+        self.transaction = None # Set by timeline.Transaction while batching up state changes
+        self.changes = ChangeLog() # Changes to all timelined objects using this clock
+        self.events = EventLog() # Events added to all timelined objects using this clock
 
     def tick(self, hour=0, minute=1, second=0):
         """Add a certain amount of time to the clock."""
         # TODO: Handling wrapping round when reaching max minutes?
-        self.now = self.now + (hour, minute, second)
-        self.moments.append(self.now)
+        self.set(self.now + (hour, minute, second))
+
+    def set(self, time):
+        """Move the clock to a specific time. This can be earlier than now, to rewind the clock."""
+        self.now = time
+        self.moments.append(time)
+        i = bisect_left(self._ords, time.ord)
+        if i == len(self._ords) or self._ords[i] != time.ord:
+            self._ords.insert(i, time.ord)
+            self._sorted.insert(i, time)
 
     def previous(self, hour=False, minute=False, second=True, start=False):
         """A previous moment before the current one.
 
 By default returns the last moment that was seen before now.
 Can choose to look at the previous minute or hour.
-  If so, by default returns the last moment in that minute or hour. Can change to first."""
-        # Account for the clock being changed back. Keep moving back
-        # TODO: account for the above. Currently only does default behaviour.
-        prev_moment = None
-        for moment in reversed(self.moments):
-            if moment >= self.now:
-                continue
-            return moment
-        # Reached the first moment without finding anything
-        # Could error instead of just passing back the start time
-        return moment
+  If so, by default returns the last moment in that minute or hour. Can change to first.
+Moments seen after the clock was rewound are ignored if they are later than now."""
+        if hour:
+            bound = hour_start(self.now.ord)
+        elif minute:
+            bound = minute_start(self.now.ord)
+        else:
+            bound = self.now.ord
+        i = bisect_left(self._ords, bound) - 1
+        if i < 0:
+            # Reached the first moment without finding anything
+            # Could error instead of just passing back the start time
+            return self._sorted[0]
+        if start and (hour or minute):
+            ordinal = self._ords[i]
+            i = bisect_left(self._ords, hour_start(ordinal) if hour else minute_start(ordinal))
+        return self._sorted[i]
+
+    def moments_in(self, hour, minute=None):
+        """All moments seen in this hour (or just this minute of it), in time order."""
+        if minute is None:
+            lo = hour << HOUR_SHIFT
+            hi = (hour + 1) << HOUR_SHIFT
+        else:
+            lo = BOTCTime(hour, minute).ord
+            hi = lo + SECOND_LIMIT
+        return self._sorted[bisect_left(self._ords, lo):bisect_left(self._ords, hi)]
 
     def last_night(self):
         """The time periods that were in last night."""
-        raise NotImplementedError()
+        return self.moments_in(self.now.h - (2 if self.now.night else 1))
 
     def last_day(self):
         """The time periods that were in last day."""
-        raise NotImplementedError()
+        return self.moments_in(self.now.h - (2 if self.now.day else 1))
+
+
+def hour_span(time):
+    """(first, last) possible times in the hour that time is in; e.g. for all of a night."""
+    start = hour_start(time.ord)
+    return BOTCTime.from_ord(start), BOTCTime.from_ord(start + (1 << HOUR_SHIFT) - 1)
+
+def hour_start(ordinal):
+    """Ordinal of the start of the hour this ordinal is in."""
+    return (ordinal >> HOUR_SHIFT) << HOUR_SHIFT
+
+def minute_start(ordinal):
+    """Ordinal of the start of the minute this ordinal is in."""
+    return (ordinal >> SECOND_BITS) << SECOND_BITS
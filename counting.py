@@ -0,0 +1,336 @@
+from memo import LRUCache, MISSING
+from propagation import *
+
+# Component results kept between counts, so unchanged parts of the superposition aren't counted again
+COMPONENT_CACHE_SIZE = 1024
+
+class WorldCounts(object):
+    """Number of possible worlds, and how many have each seat as each character.
+
+total: number of worlds
+marginals: per seat, dict of character -> number of worlds with that seat as that character"""
+    def __init__(self, total, marginals):
+        self.total = total
+        self.marginals = marginals
+
+    def options(self, seat):
+        """MultiValue of the characters seat is in some world."""
+        return MultiValue([character for character, count in self.marginals[seat].items() if count])
+
+    def fractions(self, seat):
+        """Dict of character -> fraction of worlds with seat as that character."""
+        if not self.total:
+            return {}
+        return {character: count / self.total for character, count in self.marginals[seat].items() if count}
+
+    def alive_counts(self, dead_if):
+        """Per seat, (worlds they're alive in, worlds they're dead in).
+
+dead_if: seat -> characters that seat is dead if they are (e.g. a claimed Slayer shot that only works on the demon).
+  Seats not in it are alive in every world."""
+        ret = []
+        for seat, marginal in enumerate(self.marginals):
+            dead = sum(marginal.get(character, 0) for character in dead_if.get(seat, ()))
+            ret.append((self.total - dead, dead))
+        return ret
+
+    def possibly_alive(self, dead_if):
+        return [alive > 0 for alive, _ in self.alive_counts(dead_if)]
+
+    def certainly_dead(self, dead_if):
+        return [alive == 0 for alive, _ in self.alive_counts(dead_if)]
+
+    def __str__(self):
+        return "WorldCounts({} worlds)".format(self.total)
+
+
+class WorldCounter(object):
+    """Counts the worlds of a Superposition without listing them.
+
+Seats that can't affect each other (no characters in common, and no Allowed constraint between them)
+  are counted separately, as components. Each component is summarised as a table of
+  (number of each kind, which tracked characters are in play) -> number of ways,
+  and the tables are combined to only count setups that fit SetupCounts and InPlay.
+Component tables are cached, so counting again after a commit only redoes the components that changed.
+Characters are always unique. Handles Unique, MustBe, CannotBe, InPlay, NotInPlay, Bluffs, SetupCounts and Allowed.
+Counting a component is exponential in its number of open seats, so this is for once the worlds have been
+  narrowed down; before then, use sampling."""
+    def __init__(self, maxsize=COMPONENT_CACHE_SIZE):
+        self.cache = LRUCache(maxsize)
+
+    def count(self, superposition):
+        sp = superposition.copy()
+        try:
+            sp.propagate()
+        except Contradiction:
+            return WorldCounts(0, [{} for _ in sp.domains])
+        layout = _Layout(sp)
+        components = _components(sp, layout.allowed)
+        results = []
+        for seats in components:
+            allowed = [constraint for constraint in layout.allowed if constraint.seats[0] in seats]
+            # Allowed constraints are compared by identity; holding them in the key keeps them alive,
+            #  so a new constraint can't reuse a freed one's id and pick up its counts
+            key = (tuple(sp.domains[seat] for seat in seats), tuple(seats), layout.key, tuple(allowed))
+            result = self.cache.get(key)
+            if result is MISSING:
+                if allowed:
+                    result = _enumerate_component(sp, seats, allowed, layout)
+                else:
+                    result = _count_component(sp, seats, layout)
+                self.cache.put(key, result)
+            results.append(result)
+        # Everything but each component, from products of those before and after it
+        polys = [poly for poly, _ in results]
+        before = [{layout.zero: 1}]
+        for poly in polys[:-1]:
+            before.append(_convolve(before[-1], poly))
+        after = [{layout.zero: 1}]
+        for poly in reversed(polys[1:]):
+            after.append(_convolve(after[-1], poly))
+        after.reverse()
+        total = sum(count for vector, count in _convolve(before[-1], polys[-1]).items()
+                    if layout.accepts(vector)) if polys else 1
+        marginals = [{} for _ in sp.domains]
+        for i, (_, component_marginals) in enumerate(results):
+            others = _convolve(before[i], after[i])
+            for (seat, character), poly in component_marginals.items():
+                count = sum(count for vector, count in _convolve(poly, others).items() if layout.accepts(vector))
+                if count:
+                    marginals[seat][character] = count
+        return WorldCounts(total, marginals)
+
+
+class _Layout(object):
+    """How a component's contribution is summarised: counts of each kind, then flags for tracked characters."""
+    def __init__(self, sp):
+        self.setups = []
+        self.in_play = []
+        self.allowed = []
+        for propagator in sp.propagators:
+            if isinstance(propagator, SetupCounts):
+                self.setups.append(propagator)
+            elif isinstance(propagator, NotInPlay) or isinstance(propagator, (Unique, MustBe)):
+                pass # Already applied to the domains
+            elif isinstance(propagator, InPlay):
+                self.in_play.extend(propagator.characters)
+            elif isinstance(propagator, Allowed):
+                self.allowed.append(propagator)
+            else:
+                raise ValueError("Can't count worlds with a " + type(propagator).__name__ + " constraint.")
+        self.kinds = sorted({kind for setup in self.setups for kind in setup.counts})
+        tracked = list(self.in_play)
+        for setup in self.setups:
+            tracked.extend(setup.modifiers)
+        self.tracked = list(dict.fromkeys(tracked))
+        self.zero = (0,) * (len(self.kinds) + len(self.tracked))
+        self.contributions = []
+        for character in sp.characters:
+            vector = [0] * len(self.zero)
+            kind = sp.kinds.get(character)
+            if kind in self.kinds:
+                vector[self.kinds.index(kind)] = 1
+            if character in self.tracked:
+                vector[len(self.kinds) + self.tracked.index(character)] = 1
+            self.contributions.append(tuple(vector))
+        # Most of each kind any setup can have, so partial counts over that can be dropped
+        limits = []
+        for kind in self.kinds:
+            limit = None
+            for setup in self.setups:
+                if kind in setup.counts:
+                    most = setup.counts[kind] + sum(max(changes.get(kind, 0), 0) for changes in setup.modifiers.values())
+                    limit = most if limit is None else min(limit, most)
+            limits.append(limit)
+        self.limits = tuple(limits) + (1,) * len(self.tracked)
+        # Everything component tables depend on, besides the component's domains
+        self.key = (tuple(sp.characters), tuple(self.kinds), tuple(self.tracked), self.limits, tuple(self.contributions))
+
+    def within(self, vector):
+        return all(x <= limit for x, limit in zip(vector, self.limits))
+
+    def accepts(self, vector):
+        flags = dict(zip(self.tracked, vector[len(self.kinds):]))
+        if not all(flags[character] for character in self.in_play):
+            return False
+        for setup in self.setups:
+            targets = dict(setup.counts)
+            for character, changes in setup.modifiers.items():
+                if flags[character]:
+                    for kind, change in changes.items():
+                        targets[kind] = targets.get(kind, 0) + change
+            for kind, target in targets.items():
+                if kind in self.kinds and vector[self.kinds.index(kind)] != target:
+                    return False
+        return True
+
+
+def _add(a, b):
+    return tuple(x + y for x, y in zip(a, b))
+
+def _convolve(first, second):
+    ret = {}
+    for a, x in first.items():
+        for b, y in second.items():
+            vector = _add(a, b)
+            ret[vector] = ret.get(vector, 0) + x * y
+    return ret
+
+def _components(sp, allowed):
+    """Lists of seats that can affect each other."""
+    parent = list(range(len(sp.domains)))
+    def find(seat):
+        while parent[seat] != seat:
+            parent[seat] = parent[parent[seat]]
+            seat = parent[seat]
+        return seat
+    owner = {} # character bit -> first seat seen with it
+    for seat, domain in enumerate(sp.domains):
+        for i in range(domain.bit_length()):
+            if domain >> i & 1:
+                if i in owner:
+                    parent[find(seat)] = find(owner[i])
+                else:
+                    owner[i] = seat
+    for constraint in allowed:
+        for seat in constraint.seats[1:]:
+            parent[find(seat)] = find(constraint.seats[0])
+    groups = {}
+    for seat in range(len(sp.domains)):
+        groups.setdefault(find(seat), []).append(seat)
+    return list(groups.values())
+
+def _count_component(sp, seats, layout):
+    """(table, marginal tables) for a component, by going through its characters in turn.
+
+States are (seats filled so far, summary so far). Counting forwards and backwards gives the number of
+  ways with each seat as each character, without listing the ways."""
+    n = len(seats)
+    full = (1 << n) - 1
+    characters = [i for i in range(len(sp.characters)) if any(sp.domains[seat] >> i & 1 for seat in seats)]
+    can_have = [sum(1 << local for local, seat in enumerate(seats) if sp.domains[seat] >> i & 1)
+                for i in characters]
+    forwards = [{(0, layout.zero): 1}]
+    for k, (i, mask) in enumerate(zip(characters, can_have)):
+        contribution = layout.contributions[i]
+        left = len(characters) - k - 1 # Characters after this one
+        states = {}
+        for (filled, vector), count in forwards[-1].items():
+            # Not in play, if the characters left can still fill the seats
+            if n - filled.bit_count() <= left:
+                states[(filled, vector)] = states.get((filled, vector), 0) + count
+            free = mask & ~filled
+            if not free:
+                continue
+            added = _add(vector, contribution)
+            if not layout.within(added) or n - filled.bit_count() - 1 > left:
+                continue
+            while free:
+                bit = free & -free
+                free ^= bit
+                key = (filled | bit, added)
+                states[key] = states.get(key, 0) + count
+        forwards.append(states)
+    poly = {}
+    for (filled, vector), count in forwards[-1].items():
+        if filled == full:
+            poly[vector] = poly.get(vector, 0) + count
+    # backwards[k][filled]: summaries of the ways to fill the rest with characters k onwards
+    backwards = [None] * len(characters) + [{full: {layout.zero: 1}}]
+    for k in range(len(characters) - 1, -1, -1):
+        contribution = layout.contributions[characters[k]]
+        later = backwards[k + 1]
+        states = {}
+        for filled in {filled for filled, _ in forwards[k]}:
+            ways = dict(later.get(filled, {}))
+            free = can_have[k] & ~filled
+            while free:
+                bit = free & -free
+                free ^= bit
+                for vector, count in later.get(filled | bit, {}).items():
+                    vector = _add(vector, contribution)
+                    if layout.within(vector):
+                        ways[vector] = ways.get(vector, 0) + count
+            if ways:
+                states[filled] = ways
+        backwards[k] = states
+    marginals = {}
+    for k, i in enumerate(characters):
+        contribution = layout.contributions[i]
+        for local, seat in enumerate(seats):
+            bit = 1 << local
+            if not can_have[k] & bit:
+                continue
+            poly_here = {}
+            for (filled, vector), count in forwards[k].items():
+                if filled & bit:
+                    continue
+                start = _add(vector, contribution)
+                for rest, ways in backwards[k + 1].get(filled | bit, {}).items():
+                    total = _add(start, rest)
+                    if layout.within(total):
+                        poly_here[total] = poly_here.get(total, 0) + count * ways
+            if poly_here:
+                marginals[(seat, sp.characters[i])] = poly_here
+    return poly, marginals
+
+def _enumerate_component(sp, seats, allowed, layout):
+    """(table, marginal tables) for a component with Allowed constraints, by listing its worlds."""
+    poly = {}
+    marginals = {}
+    chosen = {}
+    position = {seat: n for n, seat in enumerate(seats)}
+    # Check each constraint once its last seat is chosen
+    checks = [[] for _ in seats]
+    for constraint in allowed:
+        checks[max(position[seat] for seat in constraint.seats)].append(constraint)
+    def search(n, used, vector):
+        if n == len(seats):
+            poly[vector] = poly.get(vector, 0) + 1
+            for seat, i in chosen.items():
+                key = (seat, sp.characters[i])
+                table = marginals.setdefault(key, {})
+                table[vector] = table.get(vector, 0) + 1
+            return
+        seat = seats[n]
+        domain = sp.domains[seat] & ~used
+        while domain:
+            bit = domain & -domain
+            domain ^= bit
+            i = bit.bit_length() - 1
+            chosen[seat] = i
+            if all(constraint.predicate(*(sp.characters[chosen[s]] for s in constraint.seats))
+                   for constraint in checks[n]):
+                search(n + 1, used | bit, _add(vector, layout.contributions[i]))
+        chosen.pop(seat, None)
+    search(0, 0, layout.zero)
+    return poly, marginals
+
+
+if __name__ == "__main__":
+    # Counting again with rebuilt constraints must match listing the worlds
+    counter = WorldCounter()
+    characters = ["A", "B", "C", "D"]
+    for n in range(30):
+        y = characters[n % len(characters)]
+        sp = Superposition(3, characters).add(Unique())
+        sp.add(Allowed((0, 1), lambda p, q, y=y: not (p == "A" and q == y)))
+        expected = [{} for _ in range(3)]
+        worlds = list(sp.assignments())
+        for world in worlds:
+            for seat, character in enumerate(world):
+                expected[seat][character] = expected[seat].get(character, 0) + 1
+        counts = counter.count(sp)
+        assert counts.total == len(worlds), (n, counts.total, len(worlds))
+        assert counts.marginals == expected, (n, counts.marginals, expected)
+        # Free the constraint, so the next one can be given its id
+        del sp
+    # Setups with the same domains but different modifiers (so different limits) mustn't share tables
+    counter = WorldCounter()
+    characters = ["T1", "T2", "T3", "O1"]
+    kinds = {"T1": 0, "T2": 0, "T3": 0, "O1": 1}
+    for modifiers in ({"T1": {0: 0}}, {"T1": {0: 1, 1: -1}}):
+        sp = Superposition(2, characters, kinds).add(Unique()).add(SetupCounts({0: 1, 1: 1}, modifiers))
+        counts = counter.count(sp)
+        assert counts.total == len(list(sp.assignments())) == WorldCounter().count(sp).total, (modifiers, counts.total)
+    print("ok")
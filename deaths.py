@@ -0,0 +1,94 @@
+import numpy as np
+
+class DeathTracker(object):
+    """Who is possibly alive and who is certainly dead, across the worlds still possible.
+
+Keeps each world's alive bitmask and, per seat, how many remaining worlds they're alive in.
+  A seat is certainly dead when that count reaches 0.
+Nominations, executions and claims during the day only touch the worlds they change,
+  so the storyteller can announce deaths straight away without looking at every world again.
+World numbers match those of the PlayerTable or list of worlds it was made from;
+  worlds can be given as indices or as a boolean mask (e.g. from PlayerTable queries)."""
+    def __init__(self, alive, seats):
+        self.seats = seats
+        self.alive = np.array(alive, dtype=np.int64)
+        self.remaining = np.ones(len(self.alive), dtype=bool)
+        self._bits = np.int64(1) << np.arange(seats, dtype=np.int64)
+        self.alive_counts = self._alive_in(self.alive).sum(axis=0)
+        self._announced = self.certainly_dead()
+
+    @classmethod
+    def from_table(cls, table):
+        """Tracker for the worlds in a PlayerTable."""
+        return cls(table.alive, table.seats)
+
+    @classmethod
+    def from_players(cls, worlds):
+        """Tracker for a list of worlds, each a list of Players in seat order."""
+        worlds = [list(players) for players in worlds]
+        seats = len(worlds[0]) if worlds else 0
+        alive = [sum(1 << i for i, player in enumerate(players) if player.alive) for players in worlds]
+        return cls(alive, seats)
+
+    def _alive_in(self, alive):
+        """(worlds, seats) boolean array of who is alive in these alive bitmasks."""
+        return (alive[:, None] & self._bits) != 0
+
+    def _select(self, worlds):
+        """Boolean mask of the remaining worlds out of these."""
+        if worlds is None:
+            return self.remaining.copy()
+        mask = np.zeros(len(self.alive), dtype=bool)
+        mask[worlds] = True
+        return mask & self.remaining
+
+    # Changes
+
+    def prune(self, worlds):
+        """These worlds are no longer possible; e.g. a claim or nomination ruled them out."""
+        removed = self._select(worlds)
+        if removed.any():
+            self.alive_counts -= self._alive_in(self.alive[removed]).sum(axis=0)
+            self.remaining &= ~removed
+        return int(removed.sum())
+
+    def keep(self, worlds):
+        """Only these worlds are still possible."""
+        mask = np.zeros(len(self.alive), dtype=bool)
+        mask[worlds] = True
+        return self.prune(~mask)
+
+    def kill(self, seat, worlds=None):
+        """seat dies in these worlds (default all); e.g. an execution, or a Slayer shot that works in some."""
+        bit = self._bits[seat]
+        dying = self._select(worlds) & ((self.alive & bit) != 0)
+        self.alive_counts[seat] -= int(dying.sum())
+        self.alive[dying] &= ~bit
+        return int(dying.sum())
+
+    def execute(self, seat, dies=None):
+        """seat is executed. dies: worlds where the execution kills them, if it doesn't in all of them."""
+        return self.kill(seat, dies)
+
+    # Queries
+
+    def possibly_alive(self):
+        """Boolean array of seats alive in some remaining world."""
+        return self.alive_counts > 0
+
+    def certainly_dead(self):
+        """Boolean array of seats dead in every remaining world."""
+        return self.alive_counts == 0
+
+    def world_count(self):
+        return int(self.remaining.sum())
+
+    def announce(self):
+        """(certainly dead seats, seats that became certainly dead since the last announcement)."""
+        dead = self.certainly_dead()
+        new = dead & ~self._announced
+        self._announced = dead
+        return np.flatnonzero(dead).tolist(), np.flatnonzero(new).tolist()
+
+    def __str__(self):
+        return "DeathTracker({} worlds, {} certainly dead)".format(self.world_count(), int(self.certainly_dead().sum()))
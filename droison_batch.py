@@ -0,0 +1,100 @@
+import numpy as np
+
+# Droison loop analysis for many worlds at once.
+# Players are seat numbers, and each world's droisoning is an adjacency list of bitmasks:
+#  adjacency[w, i] has bit j set if seat i is trying to droison seat j in world w.
+# Seat counts are small (at most ~20), so bitmasks fit comfortably in an int64.
+
+MAX_SEATS = 62
+
+def droison_masks(adjacency):
+    """Which seats are droisoned, in droison loops, or sober, in each world.
+
+adjacency: (worlds, seats) int array of droisoning bitmasks, as above.
+Returns (droisoned, looped, sober) arrays of bitmasks, one per world.
+  Same peeling as networking.droisoned_tokens: a seat is sober if everyone droisoning it is droisoned,
+  and droisoned if anyone droisoning it is sober. Seats that are neither are in loops.
+  Seats not involved in any droisoning are sober."""
+    adjacency = np.asarray(adjacency, dtype=np.int64)
+    if adjacency.ndim != 2:
+        raise ValueError("Adjacency must be a (worlds, seats) array, not shape " + str(adjacency.shape) + ".")
+    worlds, seats = adjacency.shape
+    if seats > MAX_SEATS:
+        raise ValueError("Can't have more than {} seats, not {}.".format(MAX_SEATS, seats))
+    seat_nums = np.arange(seats, dtype=np.int64)
+    bits = np.int64(1) << seat_nums
+    # Who is droisoning each seat: transpose the (worlds, from, to) bit matrix
+    edges = (adjacency[:, :, None] >> seat_nums) & 1
+    preds = np.bitwise_or.reduce(edges * bits[:, None], axis=1)
+    droisoned = np.zeros(worlds, dtype=np.int64)
+    sober = np.zeros(worlds, dtype=np.int64)
+    # Each round settles at least one more seat in any world that's still changing
+    for _ in range(seats + 1):
+        # Seats with no undroisoned droisoners are sober; seats with a sober droisoner are droisoned
+        now_sober = np.bitwise_or.reduce(
+            np.where((preds & ~droisoned[:, None]) == 0, bits, 0), axis=1)
+        now_droisoned = np.bitwise_or.reduce(
+            np.where((preds & sober[:, None]) != 0, bits, 0), axis=1)
+        if np.array_equal(now_sober, sober) and np.array_equal(now_droisoned, droisoned):
+            break
+        sober, droisoned = now_sober, now_droisoned
+    full = np.int64((1 << seats) - 1)
+    looped = full & ~(sober | droisoned)
+    return droisoned, looped, sober
+
+def hidden_edges(adjacency, droisoned, looped):
+    """Droisoning that is hidden in each world, as a (worlds, seats) array of bitmasks.
+
+Droisoned seats have all their droisoning hidden. Seats in loops keep droisoning that is part of a loop
+  (on other seats in loops), but anything pointing out of the loops is hidden.
+Other (non-droisoning) tokens placed by droisoned or looped seats are hidden too; see hidden_tokens."""
+    adjacency = np.asarray(adjacency, dtype=np.int64)
+    seats = adjacency.shape[1]
+    bits = np.int64(1) << np.arange(seats, dtype=np.int64)
+    is_droisoned = (droisoned[:, None] & bits) != 0
+    is_looped = (looped[:, None] & bits) != 0
+    return np.where(is_droisoned, adjacency,
+                    np.where(is_looped, adjacency & ~looped[:, None], 0))
+
+# Conversions from Players
+
+def adjacency(worlds):
+    """(worlds, seats) adjacency array for a list of worlds, each a list of Players in seat order."""
+    worlds = list(worlds)
+    seats = len(worlds[0]) if worlds else 0
+    ret = np.zeros((len(worlds), seats), dtype=np.int64)
+    for w, players in enumerate(worlds):
+        if len(players) != seats:
+            raise ValueError("All worlds must have the same number of seats.")
+        seat_of = {id(player): i for i, player in enumerate(players)}
+        for i, player in enumerate(players):
+            mask = 0
+            for other, _ in player.droisoning_tokens():
+                mask |= 1 << seat_of[id(other)]
+            ret[w, i] = mask
+    return ret
+
+def hidden_tokens(players, droisoned, looped):
+    """Hidden tokens for one world, in the same format as networking.droisoned_tokens.
+
+droisoned and looped are that world's bitmasks from droison_masks."""
+    droisoned = int(droisoned)
+    looped = int(looped)
+    seat_of = {id(player): i for i, player in enumerate(players)}
+    ret = []
+    for i, player in enumerate(players):
+        if droisoned >> i & 1:
+            ret.append((player, player.placed_reminders))
+        elif looped >> i & 1:
+            to_remove = [(other, token) for other, token in player.placed_reminders
+                         if not (token.droisons and looped >> seat_of[id(other)] & 1)]
+            if to_remove:
+                ret.append((player, to_remove))
+    return ret
+
+def droisoned_tokens_batch(worlds):
+    """networking.droisoned_tokens for many worlds at once. Returns a list of results, one per world."""
+    worlds = [list(players) for players in worlds]
+    adj = adjacency(worlds)
+    droisoned, looped, _ = droison_masks(adj)
+    return [hidden_tokens(players, droisoned[w], looped[w]) for w, players in enumerate(worlds)]
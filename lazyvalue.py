@@ -0,0 +1,233 @@
+import weakref
+
+from multivalue import *
+
+def lazy_unaries(methods):
+    """Turn these method calls into deferred unary calls, returning LazyValues."""
+    def method_wrapper(cls):
+        for method in methods:
+            # Late binding closures means we need bound_method
+            def mwrap(self, *args, bound_method=method):
+                return LazyValue.node(bound_method, (self,), args)
+            setattr(cls, method, mwrap)
+        return cls
+    return method_wrapper
+
+def lazy_binaries(methods):
+    """Turn these method calls into deferred binary calls, returning LazyValues.
+
+Second value can be a LazyValue, MultiValue or single valued."""
+    def method_wrapper(cls):
+        for method in methods:
+            # Late binding closures means we need bound_method
+            def mwrap(self, other, *args, bound_method=method):
+                if isinstance(other, MultiValue):
+                    other = lazy(other)
+                return LazyValue.node(bound_method, (self, other), args)
+            setattr(cls, method, mwrap)
+        return cls
+    return method_wrapper
+
+@lazy_unaries(UNARY_METHODS)
+@lazy_binaries([method for method in BINARY_METHODS if method != "__contains__"])
+# Methods handled specially: __contains__ (searches, stopping at the first match), __or__, __and__
+# Methods deliberately not included: __bool__ (as with MultiValue, use any or all)
+class LazyValue(object):
+    """A MultiValue that is only worked out when it is looked at.
+
+Operations build up an expression graph instead of working out all combinations straight away.
+  Values are generated when iterated over, or when any, all, to_bool or 'in' are used.
+  These stop generating as soon as the answer is known, so e.g. 'is anyone possibly dead' doesn't
+  have to look at every combination.
+Nodes are shared; doing the same operation on the same LazyValues gives back the same node.
+  Each node remembers the values it has generated so far, so shared subexpressions are only
+  worked out once, however many times (or places) they are iterated.
+Start an expression with lazy(multivalue); MultiValues on the left of an operation don't know
+  how to defer it."""
+    # Nodes by (op, operands, args), so common subexpressions are shared
+    _nodes = weakref.WeakValueDictionary()
+
+    def __init__(self, op, operands=(), args=()):
+        self._op = op
+        self._operands = operands
+        self._args = args
+        self._cache = [] # Values generated so far, without duplicates
+        self._seen = set() # Hashable values in _cache, for quick duplicate checks
+        self._gen = self._generate()
+
+    @classmethod
+    def node(cls, op, operands=(), args=()):
+        """Get the node for this operation, making it if needed."""
+        try:
+            key = (op, tuple(id(x) if isinstance(x, LazyValue) else _static_key(x) for x in operands),
+                   tuple(map(_static_key, args)))
+            hash(key)
+        except TypeError:
+            # Unhashable single values can't be shared
+            return cls(op, operands, args)
+        ret = cls._nodes.get(key)
+        if ret is None:
+            ret = cls(op, operands, args)
+            cls._nodes[key] = ret
+        return ret
+
+    # Evaluation
+
+    def _generate(self):
+        """Generate values from this node, possibly with duplicates."""
+        op = self._op
+        if op == "source":
+            yield from self._operands[0]
+        elif op == "getattr":
+            name, = self._args
+            for x in self._operands[0]:
+                yield getattr(x, name)
+        elif op == "truths":
+            yield from self._generate_truths()
+        elif op in ("__or__", "__and__"):
+            yield from self._generate_bools()
+        elif len(self._operands) == 1:
+            for x in self._operands[0]:
+                yield getattr(x, op).__call__(*self._args)
+        else:
+            first, second = self._operands
+            if isinstance(second, LazyValue):
+                for x in first:
+                    for y in second:
+                        yield getattr(x, op).__call__(y, *self._args)
+            else:
+                for x in first:
+                    yield getattr(x, op).__call__(second, *self._args)
+
+    def _generate_truths(self):
+        """Generate boolean values, stopping once both have been seen."""
+        seen = set()
+        for val in self._operands[0]:
+            truth = bool(val)
+            if truth not in seen:
+                seen.add(truth)
+                yield truth
+                if len(seen) == 2:
+                    return
+
+    def _generate_bools(self):
+        """Generate boolean | or & combinations, using only which truth values each side can have."""
+        first, second = self._operands
+        combine = (lambda x, y: x or y) if self._op == "__or__" else (lambda x, y: x and y)
+        seconds = second.truths() if isinstance(second, LazyValue) else (bool(second),)
+        for x in first.truths():
+            for y in seconds:
+                yield combine(x, y)
+
+    def __iter__(self):
+        i = 0
+        cache = self._cache
+        while True:
+            if i < len(cache):
+                yield cache[i]
+                i += 1
+            elif not self._pull():
+                return
+
+    def _pull(self):
+        """Generate the next new value into the cache. Returns False if there are none left."""
+        if self._gen is None:
+            return False
+        for val in self._gen:
+            try:
+                if val in self._seen:
+                    continue
+                self._seen.add(val)
+            except TypeError:
+                # Unhashable, so fall back to checking the list
+                if val in self._cache:
+                    continue
+            self._cache.append(val)
+            return True
+        self._gen = None
+        return False
+
+    def values(self):
+        """Work out all the values, returning them as a MultiValue."""
+        return MultiValue(self)
+
+    def any(self, truth_fn=bool):
+        """Whether any value is true. Stops at the first true value."""
+        return any(truth_fn(val) for val in self)
+
+    def all(self, truth_fn=bool):
+        """Whether all values are true. Stops at the first false value."""
+        return all(truth_fn(val) for val in self)
+
+    def truths(self):
+        """LazyValue of the boolean values of these options. Stops once both True and False are seen."""
+        return LazyValue.node("truths", (self,))
+
+    def to_bool(self, truth_fn=bool):
+        """Return a MultiValue of the boolean values of these options.
+
+truth_fn: Optional function for deciding truthiness; e.g., >= 2"""
+        out = set()
+        for val in self:
+            out.add(bool(truth_fn(val)))
+            if len(out) == 2:
+                break
+        return MultiValue(out)
+
+    # Specially handled pass-throughs
+
+    def __getattr__(self, name):
+        # Only called if not found normally. Don't pass through special lookups (pickling, copying etc.)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return LazyValue.node("getattr", (self,), (name,))
+
+    def __contains__(self, value):
+        for val in self:
+            if val == value:
+                return True
+        return False
+
+    # Optimised or removed __ operations
+
+    def __bool__(self):
+        # Not going to turn to single valued if only one option. Otherwise, will allow annoying bugs.
+        raise NotImplementedError("Must use any or all to get single valued boolean. Use to_bool to get a boolean MultiValue.")
+
+    def __or__(self, other):
+        """A LazyValue of all possible boolean | combinations"""
+        if isinstance(other, MultiValue):
+            other = lazy(other)
+        return LazyValue.node("__or__", (self, other))
+
+    def __and__(self, other):
+        """A LazyValue of all possible boolean & combinations"""
+        if isinstance(other, MultiValue):
+            other = lazy(other)
+        return LazyValue.node("__and__", (self, other))
+
+    __hash__ = object.__hash__
+
+    def __str__(self):
+        return "LazyValue({})".format(self._op)
+
+    def __repr__(self):
+        return str(self)
+
+
+def _static_key(value):
+    """Key for a value that isn't lazy. Includes types, as e.g. 1, 1.0 and True are equal but don't act the same."""
+    if isinstance(value, tuple):
+        return ("static", type(value), tuple(value), tuple(map(type, value)))
+    return ("static", type(value), value)
+
+def lazy(value):
+    """A LazyValue for the options in value. Gives back the same LazyValue for the same object."""
+    if isinstance(value, LazyValue):
+        return value
+    key = ("source", (id(value),), ())
+    ret = LazyValue._nodes.get(key)
+    if ret is None:
+        ret = LazyValue("source", (value,))
+        LazyValue._nodes[key] = ret
+    return ret
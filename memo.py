@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+# Returned by get when there's no entry, since None can be a cached value
+MISSING = object()
+
+class LRUCache(object):
+    """Cache with a maximum size, which evicts the least recently used entries first.
+
+Counts hits and misses, so it's possible to see whether the cache is worth having."""
+    def __init__(self, maxsize=1024):
+        if maxsize <= 0:
+            raise ValueError("Cache size must be positive, not " + str(maxsize) + ".")
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        """Cached value for key, or default if there isn't one. Counts as a use of the entry."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Cache a value, evicting the oldest entry if full."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def remove_where(self, predicate):
+        """Remove all entries whose key matches predicate."""
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self):
+        """Remove all entries. Doesn't reset the counters."""
+        self._entries.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def stats(self):
+        """Dict of hits, misses, evictions and current size."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self._entries), "maxsize": self.maxsize}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "LRUCache({hits} hits, {misses} misses, {size}/{maxsize} entries)".format(**self.stats)
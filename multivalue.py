@@ -1,5 +1,63 @@
 import functools
 
+from memo import LRUCache, MISSING
+
+# Optional cache of operation results, shared by all MultiValues. See enable_op_cache.
+_op_cache = None
+
+def enable_op_cache(maxsize=1024):
+    """Start caching the results of MultiValue operations, returning the cache.
+
+Results are keyed on the operation name and the contents of the operands, so repeating the same
+  operation (e.g. the same character options against the same token options) is served from memory.
+Operations on unhashable values aren't cached.
+The cache keeps at most maxsize results, evicting the least recently used."""
+    global _op_cache
+    _op_cache = LRUCache(maxsize)
+    return _op_cache
+
+def disable_op_cache():
+    """Stop caching MultiValue operation results, and drop the cache."""
+    global _op_cache
+    _op_cache = None
+
+def op_cache():
+    """The current operation cache, or None if not enabled."""
+    return _op_cache
+
+def _op_key(method, operands, kwargs):
+    """Cache key for an operation, or None if it can't be cached."""
+    key = [method, tuple(sorted(kwargs.items()))]
+    for operand in operands:
+        if isinstance(operand, MultiValue):
+            # Include types, as e.g. 1 and 1.0 are equal but don't act the same
+            key.append((type(operand), tuple(operand), tuple(map(type, operand))))
+        else:
+            key.append((type(operand), operand))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def op_cached(method, mwrap):
+    """Wrap an operation, so that its results are looked up in the op cache if enabled."""
+    @functools.wraps(mwrap)
+    def cwrap(self, *args, **kwargs):
+        cache = _op_cache
+        if cache is None:
+            return mwrap(self, *args, **kwargs)
+        key = _op_key(method, (self,) + args, kwargs)
+        if key is None:
+            return mwrap(self, *args, **kwargs)
+        ret = cache.get(key)
+        if ret is MISSING:
+            ret = mwrap(self, *args, **kwargs)
+            cache.put(key, ret)
+        return ret
+    return cwrap
+
 def unaries(methods):
     """Turn these method calls into unary calls to return MultiValues."""
     def method_wrapper(cls):
@@ -10,7 +68,7 @@ def unaries(methods):
             # Late binding closures means we need bound_method
             def mwrap(self, *args, bound_method=method, **kwargs):
                 return MultiValue([getattr(x, bound_method).__call__(*args, **kwargs) for x in self], rem_dups=True)
-            setattr(UnaryWrap, method, mwrap)
+            setattr(UnaryWrap, method, op_cached(method, mwrap))
         return UnaryWrap
     return method_wrapper
 
@@ -27,19 +85,67 @@ def binaries(methods):
                     return MultiValue([getattr(x, bound_method).__call__(y, *args, **kwargs) for x in self for y in other], rem_dups=True)
                 else:
                     return MultiValue([getattr(x, bound_method).__call__(other, *args, **kwargs) for x in self], rem_dups=True)
-            setattr(BinaryWrap, method, mwrap)
+            setattr(BinaryWrap, method, op_cached(method, mwrap))
         return BinaryWrap
     return method_wrapper
 
-@unaries(("__ceil__","__float__","__floor__","__int__","__invert__",
-          "__neg__","__pos__","__round__","__trunc__",))
-@binaries(("__add__","__eq__","__floordiv__","__ge__","__gt__","__le__","__lshift__","__lt__",
-           "__mod__","__mul__","__ne__","__pow__","__radd__","__rand__","__rdiv__","__rfloordiv__",
-           "__rlshift__","__rmod__","__rmul__","__ror__","__rpow__","__rrshift__","__rshift__",
-           "__rsub__","__rtruediv__","__rxor__","__sub__","__truediv__","__xor__","__contains__",))
+def world_unaries(methods):
+    """As unaries, but each result keeps the world its value came from."""
+    def method_wrapper(cls):
+        @functools.wraps(cls, updated=())
+        class WorldUnaryWrap(cls):
+            pass
+        for method in methods:
+            # Late binding closures means we need bound_method
+            def mwrap(self, *args, bound_method=method, **kwargs):
+                return WorldValue([getattr(x, bound_method).__call__(*args, **kwargs) for x in self], self.worlds)
+            setattr(WorldUnaryWrap, method, mwrap)
+        return WorldUnaryWrap
+    return method_wrapper
+
+def world_binaries(methods):
+    """As binaries, but joining on world when the second value is also a WorldValue.
+
+Worlds only in one of the values are dropped. If the second value is a plain MultiValue,
+  its options aren't tied to any world, so this falls back to all combinations."""
+    def method_wrapper(cls):
+        @functools.wraps(cls, updated=())
+        class WorldBinaryWrap(cls):
+            pass
+        for method in methods:
+            # Late binding closures means we need bound_method
+            def mwrap(self, other, *args, bound_method=method, **kwargs):
+                if isinstance(other, WorldValue):
+                    index = other.index
+                    worlds = []
+                    out = []
+                    for world, x in zip(self.worlds, self):
+                        i = index.get(world)
+                        if i is None:
+                            continue
+                        worlds.append(world)
+                        out.append(getattr(x, bound_method).__call__(tuple.__getitem__(other, i), *args, **kwargs))
+                    return WorldValue(out, worlds)
+                elif isinstance(other, MultiValue):
+                    return getattr(super(WorldBinaryWrap, self), bound_method).__call__(other, *args, **kwargs)
+                else:
+                    return WorldValue([getattr(x, bound_method).__call__(other, *args, **kwargs) for x in self], self.worlds)
+            setattr(WorldBinaryWrap, method, mwrap)
+        return WorldBinaryWrap
+    return method_wrapper
+
+UNARY_METHODS = ("__ceil__","__float__","__floor__","__int__","__invert__",
+                 "__neg__","__pos__","__round__","__trunc__",)
+BINARY_METHODS = ("__add__","__eq__","__floordiv__","__ge__","__gt__","__le__","__lshift__","__lt__",
+                  "__mod__","__mul__","__ne__","__pow__","__radd__","__rand__","__rdiv__","__rfloordiv__",
+                  "__rlshift__","__rmod__","__rmul__","__ror__","__rpow__","__rrshift__","__rshift__",
+                  "__rsub__","__rtruediv__","__rxor__","__sub__","__truediv__","__xor__","__contains__",)
+
+@unaries(UNARY_METHODS)
+@binaries(BINARY_METHODS)
 # Methods optimised in class: __or__, __and__
 # Methods deliberately not included: __bool__ (better to force usage any() or all(), else bugs)
-# Methods with special function: __getattribute__ (tries to get from values if not in self)
+# Methods with special function: __getattr__ (gets from values if not in self)
 class MultiValue(tuple):
     """Multiple options, with attributes and operations transparently passed through to values.
 
@@ -76,10 +182,11 @@ truth_fn: Optional function for deciding truthiness; e.g., >= 2"""
 
     # Specially handled pass-throughs
 
-    def __getattribute__(self, name):
-        if hasattr(self, name):
-            return super().__getattribute__(name)
-        return MultiValue([getattr(val, name) for val in self.values], rem_dups=True)
+    def __getattr__(self, name):
+        # Only called if not found normally. Don't pass through special lookups (pickling, copying etc.)
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return MultiValue([getattr(val, name) for val in self], rem_dups=True)
 
     # Optimised or removed __ operations
 
@@ -165,6 +272,104 @@ truth_fn: Optional function for deciding truthiness; e.g., >= 2"""
             else:
                 return self.to_bool()
 
+@world_unaries(UNARY_METHODS)
+@world_binaries(BINARY_METHODS)
+class WorldValue(MultiValue):
+    """Options for a value, each tagged with the id of the world it came from.
+
+Operations between two WorldValues join on world id, rather than taking all combinations.
+  This is linear in the number of worlds, and doesn't create options that are in no world.
+  Combining values from the same superposition keeps the same number of options.
+Duplicate values are kept, since they come from different worlds. Use options() to remove them.
+Each world can only have one value."""
+    def __new__(cls, values=(), worlds=()):
+        """values and worlds are matched up in order."""
+        ret = tuple.__new__(cls, values)
+        ret.worlds = tuple(worlds)
+        assert len(ret.worlds) == len(ret)
+        return ret
+
+    def __getnewargs__(self):
+        return (tuple(self), self.worlds)
+
+    @classmethod
+    def from_dict(cls, world_values):
+        """Create from a dict of world id to value."""
+        return cls(world_values.values(), world_values.keys())
+
+    @property
+    def index(self):
+        """Dict from world id to position in this value. Built on first use."""
+        index = self.__dict__.get("_index")
+        if index is None:
+            index = {world: i for i, world in enumerate(self.worlds)}
+            self._index = index
+        return index
+
+    def items(self):
+        """(world, value) pairs."""
+        return zip(self.worlds, self)
+
+    def value(self, world):
+        """Value in a specific world."""
+        return tuple.__getitem__(self, self.index[world])
+
+    def restrict(self, worlds):
+        """Only the options from these worlds."""
+        index = self.index
+        kept = [world for world in worlds if world in index]
+        return WorldValue([tuple.__getitem__(self, index[world]) for world in kept], kept)
+
+    def options(self):
+        """A plain MultiValue of the options, forgetting which worlds they came from."""
+        return MultiValue(self, rem_dups=True)
+
+    # Conversion functions
+
+    def to_bool(self, truth_fn=bool):
+        """Return a WorldValue of the boolean value in each world.
+
+truth_fn: Optional function for deciding truthiness; e.g., >= 2"""
+        return WorldValue([bool(truth_fn(val)) for val in self], self.worlds)
+
+    # Specially handled pass-throughs
+
+    def __getattr__(self, name):
+        if name.startswith("__") and name.endswith("__"):
+            raise AttributeError(name)
+        return WorldValue([getattr(val, name) for val in self], self.worlds)
+
+    # Boolean combinations are per world as well
+
+    def _join_bools(self, other, combine):
+        """Join boolean values with another WorldValue on world."""
+        index = other.index
+        worlds = []
+        out = []
+        for world, val in zip(self.worlds, self):
+            i = index.get(world)
+            if i is None:
+                continue
+            worlds.append(world)
+            out.append(combine(bool(val), bool(tuple.__getitem__(other, i))))
+        return WorldValue(out, worlds)
+
+    def __or__(self, other):
+        """A WorldValue of the boolean | in each world. Plain MultiValues give all combinations."""
+        if isinstance(other, WorldValue):
+            return self._join_bools(other, lambda x, y: x or y)
+        elif isinstance(other, MultiValue):
+            return super().__or__(other)
+        return WorldValue([bool(val) or bool(other) for val in self], self.worlds)
+
+    def __and__(self, other):
+        """A WorldValue of the boolean & in each world. Plain MultiValues give all combinations."""
+        if isinstance(other, WorldValue):
+            return self._join_bools(other, lambda x, y: x and y)
+        elif isinstance(other, MultiValue):
+            return super().__and__(other)
+        return WorldValue([bool(val) and bool(other) for val in self], self.worlds)
+
 mv = MultiValue
 
 a = mv(range(10))
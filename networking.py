@@ -1,11 +1,181 @@
+from itertools import permutations, product
+from math import factorial
+
 from networkx import DiGraph
 
+from memo import LRUCache, MISSING
+
+# Droison statuses of the droisoning structures seen so far, by canonical form. See droison_statuses.
+DROISON_CACHE_SIZE = 4096
+# Most relabellings to try when picking the canonical form of a structure
+CANONICAL_PERMUTATIONS = 24
+
+_droison_cache = LRUCache(DROISON_CACHE_SIZE)
+
+def droison_cache():
+    """The cache of droison statuses, e.g. for its stats."""
+    return _droison_cache
+
+def reset_droison_cache(maxsize=DROISON_CACHE_SIZE):
+    """Replace the cache of droison statuses with an empty one of this size."""
+    global _droison_cache
+    _droison_cache = LRUCache(maxsize)
+    return _droison_cache
+
 # TODO: global game state, not just players. For e.g. minstrel
-def droisoned_tokens(players):
+def droisoned_tokens(players, cache=False):
     """Which tokens are hidden in this state due to droisoning?
 
 This is not the same as which players are droisoned; in droison loops,
-tokens pointing outside of the loop are hidden, but ones making the loop aren't"""
+tokens pointing outside of the loop are hidden, but ones making the loop aren't
+Peels bitmasks of who droisons whom (see peel_statuses). With cache, uses droison_statuses instead,
+  so the same droisoning structure is only worked out once; finding its canonical form costs more
+  than peeling small structures though, so this only helps for large ones seen many times."""
+    nodes = []
+    out = {} # id -> set of ids this player droisons
+    for player in players:
+        for other, token in player.droisoning_tokens():
+            for node in (player, other):
+                if id(node) not in out:
+                    out[id(node)] = set()
+                    nodes.append(node)
+            out[id(player)].add(id(other))
+    targets = [out[id(node)] for node in nodes]
+    if cache:
+        statuses = droison_statuses(nodes, targets, key=id)
+    else:
+        statuses = peel_statuses(droison_masks(nodes, targets, key=id))
+    status_of = {id(node): status for node, status in zip(nodes, statuses)}
+    ret = []
+    for node, status in zip(nodes, statuses):
+        if status == DROISONED:
+            ret.append((node, node.placed_reminders))
+        elif status == LOOPED:
+            to_remove = [(other, token) for other, token in node.placed_reminders
+                         if not (token.droisons and status_of.get(id(other)) == LOOPED)]
+            if to_remove:
+                ret.append((node, to_remove))
+    return ret
+
+def droison_statuses(nodes, targets, key=None):
+    """Droison status (SOBER, DROISONED or LOOPED) of each node, given who each node droisons.
+
+targets[i] is the nodes (or their keys) that nodes[i] droisons.
+Statuses only depend on the shape of the droisoning, not on which seats or tokens are involved,
+  so results are cached by a canonical form that is the same however the nodes are numbered.
+  Worlds differing only in unrelated details, or in which seats the same droison loop is in,
+  are then only worked out once."""
+    out = droison_masks(nodes, targets, key)
+    order = canonical_order(out)
+    position = [0] * len(nodes)
+    for new, old in enumerate(order):
+        position[old] = new
+    canonical = tuple(relabel(out[old], position) for old in order)
+    statuses = _droison_cache.get(canonical)
+    if statuses is MISSING:
+        statuses = tuple(peel_statuses(canonical))
+        _droison_cache.put(canonical, statuses)
+    return [statuses[position[i]] for i in range(len(nodes))]
+
+def droison_masks(nodes, targets, key=None):
+    """Bitmask of the nodes each node droisons; targets[i] is the nodes (or their keys) that nodes[i] droisons."""
+    index = {(key(node) if key else node): i for i, node in enumerate(nodes)}
+    out = [0] * len(nodes)
+    for i, others in enumerate(targets):
+        for other in others:
+            out[i] |= 1 << index[other]
+    return out
+
+def peel_statuses(out):
+    """Droison status of each node, given the bitmask of nodes each droisons.
+
+Nodes no one droisons are sober; anyone a sober node droisons is droisoned, and anyone whose droisoners
+  are all droisoned is sober. Any left over are in loops."""
+    n = len(out)
+    waiting = [0] * n # Droisoners not known to be droisoned
+    for mask in out:
+        for j in bits_of(mask):
+            waiting[j] += 1
+    statuses = [None] * n
+    settled = [i for i in range(n) if not waiting[i]]
+    for i in settled:
+        statuses[i] = SOBER
+    for i in settled: # Grows as more are settled
+        for j in bits_of(out[i]):
+            if statuses[j] is not None:
+                continue
+            if statuses[i] == SOBER:
+                statuses[j] = DROISONED
+                settled.append(j)
+            else:
+                waiting[j] -= 1
+                if not waiting[j]:
+                    statuses[j] = SOBER
+                    settled.append(j)
+    return [LOOPED if status is None else status for status in statuses]
+
+def canonical_order(out):
+    """Order to number nodes in so that the same droisoning shape always gives the same masks.
+
+out is the bitmask of nodes each node droisons.
+Nodes are grouped by repeatedly refining on their degrees and their neighbours' groups;
+  ties are broken by trying every order within the groups, keeping the smallest masks.
+  If there are too many of those to try, ties are left in the order given; the result is still correct
+  to cache on, but structures that are numbered differently won't share an entry."""
+    n = len(out)
+    ins = [0] * n
+    for i, mask in enumerate(out):
+        for j in bits_of(mask):
+            ins[j] |= 1 << i
+    colours = [0] * n
+    for _ in range(n):
+        signatures = [(colours[i], tuple(sorted(colours[j] for j in bits_of(out[i]))),
+                       tuple(sorted(colours[j] for j in bits_of(ins[i]))), out[i] >> i & 1) for i in range(n)]
+        ranks = {sig: rank for rank, sig in enumerate(sorted(set(signatures)))}
+        new_colours = [ranks[sig] for sig in signatures]
+        if len(set(new_colours)) == len(set(colours)):
+            break
+        colours = new_colours
+    groups = {}
+    for i in range(n):
+        groups.setdefault(colours[i], []).append(i)
+    groups = [groups[colour] for colour in sorted(groups)]
+    tries = 1
+    for group in groups:
+        tries *= factorial(len(group))
+    if tries > CANONICAL_PERMUTATIONS:
+        return [i for group in groups for i in group]
+    best = None
+    for orders in product(*(permutations(group) for group in groups)):
+        order = [i for group in orders for i in group]
+        position = [0] * n
+        for new, old in enumerate(order):
+            position[old] = new
+        masks = tuple(relabel(out[old], position) for old in order)
+        if best is None or masks < best[0]:
+            best = (masks, order)
+    return best[1] if best else []
+
+def relabel(mask, position):
+    """Bitmask with each bit i moved to position[i]."""
+    ret = 0
+    for i in bits_of(mask):
+        ret |= 1 << position[i]
+    return ret
+
+def bits_of(mask):
+    """Positions of the set bits in mask."""
+    i = 0
+    while mask:
+        if mask & 1:
+            yield i
+        mask >>= 1
+        i += 1
+
+def peel_droisoned_tokens(players):
+    """droisoned_tokens without the cache, peeling a networkx graph each time.
+
+If a player has several droisoning tokens on the same player, only the last counts as an edge."""
     # Graph of players that are trying to droison, edges as tokens they use
     graph = DiGraph()
     for player in players:
@@ -43,3 +213,129 @@ tokens pointing outside of the loop are hidden, but ones making the loop aren't"
         if to_remove:
             ret.append((droisoned, to_remove))
     return ret
+
+
+# Droison statuses of players in a DroisonGraph
+SOBER = 0
+DROISONED = 1
+LOOPED = 2 # In a droison loop that no sober player breaks
+
+class DroisonGraph(object):
+    """Droisoning between players, kept up to date as tokens are placed and taken.
+
+Gives the same hidden tokens as droisoned_tokens, without rebuilding and peeling a graph each time.
+Players passed in are given this as their droison_graph, so place_reminder and take_reminder update it.
+A player is sober if everyone droisoning them is droisoned, and droisoned if anyone droisoning them is sober.
+  Any left over are in loops.
+Changing a token only affects the status of its target and the players downstream of them,
+  so only those are worked out again; everything else keeps its status.
+This follows the players' current state. If the clock is rewound, make a new one."""
+    def __init__(self, players=()):
+        self._out = {} # player -> {other: [droisoning tokens]}
+        self._in = {} # player -> {other: number of droisoning tokens from them}
+        self._status = {} # Only for players with droisoning tokens on or from them
+        for player in players:
+            player.droison_graph = self
+            for other, token in player.droisoning_tokens():
+                self._add_edge(player, other, token)
+        self._update(list(self._status))
+
+    def add_token(self, player, other, token):
+        """player has placed a droisoning token on other."""
+        self._add_edge(player, other, token)
+        self._update([other])
+
+    def remove_token(self, player, other, token):
+        """player has taken a droisoning token from other."""
+        tokens = self._out[player][other]
+        tokens.remove(token)
+        if not tokens:
+            del self._out[player][other]
+        self._in[other][player] -= 1
+        if not self._in[other][player]:
+            del self._in[other][player]
+        self._update([other])
+        # Forget players no longer involved in any droisoning
+        for node in (player, other):
+            if node in self._status and not self._out[node] and not self._in[node]:
+                del self._out[node], self._in[node], self._status[node]
+
+    def status(self, player):
+        """SOBER, DROISONED or LOOPED."""
+        return self._status.get(player, SOBER)
+
+    def hidden_tokens(self):
+        """Which tokens are hidden due to droisoning? Same format as droisoned_tokens."""
+        ret = []
+        for player, status in self._status.items():
+            if status == DROISONED:
+                ret.append((player, player.placed_reminders))
+            elif status == LOOPED:
+                # Tokens making the loop aren't hidden, but the others are
+                out = self._out[player]
+                to_remove = [(other, token) for other, token in player.placed_reminders
+                             if not (other in out and token in out[other] and self._status[other] == LOOPED)]
+                if to_remove:
+                    ret.append((player, to_remove))
+        return ret
+
+    def _add_edge(self, player, other, token):
+        for node in (player, other):
+            if node not in self._status:
+                self._out[node] = {}
+                self._in[node] = {}
+                self._status[node] = SOBER
+        self._out[player].setdefault(other, []).append(token)
+        self._in[other][player] = self._in[other].get(player, 0) + 1
+
+    def _update(self, starts):
+        """Work out statuses again for these players and everyone downstream of them."""
+        # Players not downstream can't have anyone downstream droisoning them, so keep their status
+        todo = set()
+        stack = list(starts)
+        while stack:
+            node = stack.pop()
+            if node not in todo:
+                todo.add(node)
+                stack.extend(self._out.get(node, ()))
+        status = self._status
+        # Peel as in droisoned_tokens, but only within todo:
+        #   count who might still be sober droisoning each player, and settle anyone sober or droisoned
+        pending = {}
+        settled = []
+        for node in todo:
+            count = 0
+            droisoned = False
+            for other in self._in.get(node, ()):
+                if other in todo:
+                    count += 1
+                elif status[other] == SOBER:
+                    droisoned = True
+                elif status[other] == LOOPED:
+                    count += 1
+            if droisoned:
+                status[node] = DROISONED
+                settled.append(node)
+            elif not count:
+                status[node] = SOBER
+                settled.append(node)
+            else:
+                pending[node] = count
+        while settled:
+            node = settled.pop()
+            sober = status[node] == SOBER
+            for other in self._out[node]:
+                if other not in pending:
+                    continue # Already settled
+                if sober:
+                    del pending[other]
+                    status[other] = DROISONED
+                    settled.append(other)
+                else:
+                    pending[other] -= 1
+                    if not pending[other]:
+                        del pending[other]
+                        status[other] = SOBER
+                        settled.append(other)
+        for node in pending:
+            status[node] = LOOPED
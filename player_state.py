@@ -1,4 +1,5 @@
 from timeline import *
+from reminders import TokenIndex
 
 @timelined(ss_attrs=('alive','character','reminders','placed_reminders'))
 class Player(object):
@@ -9,34 +10,87 @@ class Player(object):
         self.position = position
         self.reminders = list(reminders) # Reminders on this player
         self.placed_reminders = list(placed_reminders) # (player, reminder) tuples this player is trying to apply
+        self.droison_graph = None # networking.DroisonGraph to keep up to date, if any
 
     def copy(self, alive=None, character=None, reminders=None, placed_reminders=None):
-        """Make a copy of this state, applying modifications as specified."""
-        raise NotImplementedError()
+        """Make a copy of this state, applying modifications as specified.
+
+The copy is a fork, so it shares history and reminders with this player until either changes them."""
+        ret = self.fork()
+        if alive is not None:
+            ret.alive = alive
+        if character is not None:
+            ret.character = character
+        if reminders is not None:
+            ret.reminders = list(reminders)
+        if placed_reminders is not None:
+            ret.placed_reminders = list(placed_reminders)
+        return ret
+
+    def __setattr__(self, name, value):
+        """Rebuild the indexes of reminders on and placed by this player when either list is replaced.
+
+Changes to the lists themselves should be made through the methods below, which keep the indexes up to date."""
+        super().__setattr__(name, value)
+        if name == "reminders":
+            self.reminder_index = TokenIndex(value)
+        elif name == "placed_reminders":
+            old = self.__dict__.get("_droisoning", ())
+            self.placed_index = TokenIndex(token for _, token in value)
+            self._droisoning = [placed for placed in value if placed[1].droisons]
+            graph = self.__dict__.get("droison_graph")
+            if graph is not None:
+                for other, token in old:
+                    graph.remove_token(self, other, token)
+                for other, token in self._droisoning:
+                    graph.add_token(self, other, token)
+
+    def forked(self, original):
+        # A fork is a different possibility, so isn't part of the original's droison graph
+        self.droison_graph = None
+        self.reminder_index = original.reminder_index.copy()
+        self.placed_index = original.placed_index.copy()
+        self._droisoning = list(original._droisoning)
 
     def add_reminder(self, reminder_token):
         """Add a reminder token to this player, and apply any state changes as such."""
         self.reminders.append(reminder_token)
+        self.reminder_index.add(reminder_token)
 
     def remove_reminder(self, reminder_token):
         """Remove a reminder token from this player, and apply any state changes."""
-        if reminder_token not in self.reminders:
+        if reminder_token not in self.reminder_index:
             raise ValueError("Reminder token "+ str(reminder_token) + " not on player" + str(self) + ".")
         self.reminders.remove(reminder_token)
+        self.reminder_index.remove(reminder_token)
 
     def place_reminder(self, reminder_token, other):
         """This player adds a reminder token to another."""
         self.placed_reminders.append((other, reminder_token)) 
+        self.placed_index.add(reminder_token)
         other.add_reminder(reminder_token)
+        if reminder_token.droisons:
+            self._droisoning.append((other, reminder_token))
+            if self.droison_graph is not None:
+                self.droison_graph.add_token(self, other, reminder_token)
 
     def take_reminder(self, reminder_token, other):
         """This player removes their reminder token from another."""
+        if reminder_token not in self.placed_index:
+            raise ValueError("Reminder token "+ str(reminder_token) + " not placed by player" + str(self) + ".")
         self.placed_reminders.remove((other, reminder_token))
+        self.placed_index.remove(reminder_token)
         other.remove_reminder(reminder_token)
+        if reminder_token.droisons:
+            self._droisoning.remove((other, reminder_token))
+            if self.droison_graph is not None:
+                self.droison_graph.remove_token(self, other, reminder_token)
 
     def droisoning_tokens(self):
-        """Which placed tokens is this player trying to droison with?"""
-        return [placed for placed in self.placed_reminders if placed[1].droisons]
+        """Which placed tokens is this player trying to droison with?
+
+Kept up to date as tokens are placed and taken, so don't change the list returned."""
+        return self._droisoning
 
     def __str__(self):
         return "Player in seat {}".format(self.position)
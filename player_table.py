@@ -0,0 +1,183 @@
+import numpy as np
+
+from player_state import *
+from droison_batch import droison_masks
+
+class PlayerTable(object):
+    """The players of many possible worlds, stored as columns of numpy arrays rather than Player objects.
+
+Worlds are rows and seats are columns:
+  alive: (worlds,) bitmasks of which seats are alive
+  characters: (worlds, seats) character ids; see character_list
+  reminders: (worlds, seats, tokens) whether each reminder token is on each seat; see token_list
+  droisons: (worlds, seats) bitmasks of who each seat is trying to droison, as in droison_batch
+Characters and tokens are numbered in the order they are first seen, per table.
+Queries answer for all worlds at once; e.g. which seats are possibly alive, or in which worlds a seat is droisoned.
+Tables are snapshots of the current state; they aren't timelined."""
+    def __init__(self, worlds, seats):
+        if seats > 62:
+            raise ValueError("Can't have more than 62 seats, not " + str(seats) + ".")
+        self.seats = seats
+        self.alive = np.zeros(worlds, dtype=np.int64)
+        self.characters = np.zeros((worlds, seats), dtype=np.int32)
+        self.reminders = np.zeros((worlds, seats, 0), dtype=bool)
+        self.droisons = np.zeros((worlds, seats), dtype=np.int64)
+        self.character_list = []
+        self.token_list = []
+        self._character_ids = {}
+        self._token_ids = {}
+        self._droison_masks = None # (droisoned, looped, sober), worked out when needed
+
+    @property
+    def worlds(self):
+        return len(self.alive)
+
+    # Numbering of characters and tokens
+
+    def character_id(self, character):
+        """Id for this character, adding it if new."""
+        ret = self._character_ids.get(character)
+        if ret is None:
+            ret = self._character_ids[character] = len(self.character_list)
+            self.character_list.append(character)
+        return ret
+
+    def token_id(self, token):
+        """Id for this reminder token, adding it (and a column of reminders) if new."""
+        ret = self._token_ids.get(token)
+        if ret is None:
+            ret = self._token_ids[token] = len(self.token_list)
+            self.token_list.append(token)
+            self.reminders = np.concatenate(
+                (self.reminders, np.zeros(self.reminders.shape[:2] + (1,), dtype=bool)), axis=2)
+        return ret
+
+    # Conversion to and from Players
+
+    @classmethod
+    def from_players(cls, worlds):
+        """Table for a list of worlds, each a list of Players in seat order."""
+        worlds = [list(players) for players in worlds]
+        seats = len(worlds[0]) if worlds else 0
+        ret = cls(len(worlds), seats)
+        for w, players in enumerate(worlds):
+            if len(players) != seats:
+                raise ValueError("All worlds must have the same number of seats.")
+            seat_of = {id(player): i for i, player in enumerate(players)}
+            alive = 0
+            for i, player in enumerate(players):
+                if player.alive:
+                    alive |= 1 << i
+                ret.characters[w, i] = ret.character_id(player.character)
+                for token in player.reminders:
+                    t = ret.token_id(token) # Can grow reminders, so get this first
+                    ret.reminders[w, i, t] = True
+                for other, _ in player.droisoning_tokens():
+                    ret.droisons[w, i] |= 1 << seat_of[id(other)]
+            ret.alive[w] = alive
+        return ret
+
+    def to_players(self, world, placed_reminders=None, clock=None):
+        """Players for one world, in seat order.
+
+Who placed each reminder isn't stored, so placed_reminders is lost unless given;
+  it can be a list (per seat) of (seat, token) pairs, which are placed on the new Players."""
+        clock = clock if clock else Clock()
+        alive = int(self.alive[world])
+        ret = []
+        for i in range(self.seats):
+            reminders = [self.token_list[t] for t in np.flatnonzero(self.reminders[world, i])]
+            ret.append(Player(self.character_list[self.characters[world, i]], i, alive=bool(alive >> i & 1),
+                              reminders=reminders, clock=clock))
+        if placed_reminders:
+            for player, placed in zip(ret, placed_reminders):
+                player.placed_reminders = [(ret[seat], token) for seat, token in placed]
+        return ret
+
+    def restrict(self, worlds):
+        """Table of just these worlds; worlds can be indices or a boolean mask."""
+        ret = type(self).__new__(type(self))
+        ret.__dict__.update(self.__dict__)
+        ret.alive = self.alive[worlds]
+        ret.characters = self.characters[worlds]
+        ret.reminders = self.reminders[worlds]
+        ret.droisons = self.droisons[worlds]
+        ret.character_list = list(self.character_list)
+        ret.token_list = list(self.token_list)
+        ret._character_ids = dict(self._character_ids)
+        ret._token_ids = dict(self._token_ids)
+        ret._droison_masks = None
+        return ret
+
+    # Changes, for all worlds at once or those in a mask
+
+    def set_alive(self, seat, alive, worlds=slice(None)):
+        if alive:
+            self.alive[worlds] |= 1 << seat
+        else:
+            self.alive[worlds] &= ~(1 << seat)
+
+    def set_droisons(self, seat, other, droisons, worlds=slice(None)):
+        """Set whether seat is trying to droison other."""
+        if droisons:
+            self.droisons[worlds, seat] |= 1 << other
+        else:
+            self.droisons[worlds, seat] &= ~(1 << other)
+        self._droison_masks = None
+
+    # Queries
+
+    def alive_in(self):
+        """(worlds, seats) boolean array of whether each seat is alive."""
+        return (self.alive[:, None] >> np.arange(self.seats)) & 1 == 1
+
+    def possibly_alive(self):
+        """Boolean array of which seats are alive in any world."""
+        return self.alive_in().any(axis=0)
+
+    def definitely_alive(self):
+        """Boolean array of which seats are alive in every world."""
+        return self.alive_in().all(axis=0)
+
+    def alive_counts(self):
+        """Number of living players in each world."""
+        return self.alive_in().sum(axis=1)
+
+    def worlds_with_character(self, seat, character):
+        """Boolean array of the worlds where seat is this character."""
+        ret = self._character_ids.get(character)
+        if ret is None:
+            return np.zeros(self.worlds, dtype=bool)
+        return self.characters[:, seat] == ret
+
+    def possible_characters(self, seat):
+        """Characters seat is in any world."""
+        return [self.character_list[c] for c in np.unique(self.characters[:, seat])]
+
+    def worlds_with_reminder(self, seat, token):
+        """Boolean array of the worlds where this reminder token is on seat."""
+        ret = self._token_ids.get(token)
+        if ret is None:
+            return np.zeros(self.worlds, dtype=bool)
+        return self.reminders[:, seat, ret]
+
+    def droison_masks(self):
+        """(droisoned, looped, sober) bitmasks of seats per world; see droison_batch.droison_masks."""
+        if self._droison_masks is None:
+            self._droison_masks = droison_masks(self.droisons)
+        return self._droison_masks
+
+    def worlds_droisoned(self, seat):
+        """Boolean array of the worlds where seat is droisoned."""
+        return (self.droison_masks()[0] >> seat) & 1 == 1
+
+    def possibly_droisoned(self):
+        """Boolean array of which seats are droisoned in any world."""
+        droisoned = np.bitwise_or.reduce(self.droison_masks()[0])
+        return (droisoned >> np.arange(self.seats)) & 1 == 1
+
+    def __len__(self):
+        return self.worlds
+
+    def __str__(self):
+        return "PlayerTable({} worlds, {} seats)".format(self.worlds, self.seats)
@@ -0,0 +1,302 @@
+from itertools import product
+
+from multivalue import *
+
+# Character kinds, for setup counts
+TOWNSFOLK = 0
+OUTSIDER = 1
+MINION = 2
+DEMON = 3
+
+class Contradiction(ValueError):
+    """The constraints can't all hold; no world is possible."""
+
+
+class Superposition(object):
+    """Who each seat can be, narrowed down by constraints without enumerating worlds.
+
+Each seat's possible characters are a bitset over the script's characters (its domain).
+Propagators (see below) remove characters that can't be right; propagate runs them all until
+  none of them can remove anything more, raising Contradiction if a seat runs out of options.
+This catches most impossibilities cheaply, but not all; assignments searches for the worlds that remain.
+Results are given as MultiValues, as elsewhere."""
+    def __init__(self, seats, characters, kinds=None):
+        """characters: all characters that could be in play. kinds: character -> kind, for setup counts."""
+        self.characters = list(characters)
+        self.kinds = dict(kinds) if kinds else {}
+        self._ids = {character: i for i, character in enumerate(self.characters)}
+        self.domains = [(1 << len(self.characters)) - 1] * seats
+        self.propagators = []
+
+    # Converting between characters and bitsets
+
+    def mask(self, characters):
+        """Bitset of these characters."""
+        ret = 0
+        for character in characters:
+            try:
+                ret |= 1 << self._ids[character]
+            except KeyError:
+                raise ValueError("Character " + str(character) + " is not in this superposition.")
+        return ret
+
+    def kind_mask(self, kind):
+        """Bitset of the characters of this kind."""
+        return self.mask(character for character in self.characters if self.kinds.get(character) == kind)
+
+    def characters_in(self, mask):
+        return [character for i, character in enumerate(self.characters) if mask >> i & 1]
+
+    # Changing domains
+
+    def restrict(self, seat, mask):
+        """Only allow seat to be characters in mask. Returns whether anything changed."""
+        new = self.domains[seat] & mask
+        if new == self.domains[seat]:
+            return False
+        if not new:
+            raise Contradiction("Seat {} has no possible characters left.".format(seat))
+        self.domains[seat] = new
+        return True
+
+    def exclude(self, seat, mask):
+        """Don't allow seat to be characters in mask. Returns whether anything changed."""
+        return self.restrict(seat, ~mask)
+
+    def add(self, *propagators):
+        self.propagators.extend(propagators)
+        return self
+
+    def propagate(self):
+        """Run the propagators until nothing changes. Raises Contradiction if no world is possible."""
+        changed = True
+        while changed:
+            changed = False
+            for propagator in self.propagators:
+                if propagator.propagate(self):
+                    changed = True
+        return self
+
+    def copy(self):
+        """A copy with separate domains, sharing the (unchanging) propagators."""
+        ret = type(self).__new__(type(self))
+        ret.__dict__.update(self.__dict__)
+        ret.domains = list(self.domains)
+        ret.propagators = list(self.propagators)
+        return ret
+
+    # Results
+
+    def options(self, seat):
+        """MultiValue of the characters seat can still be."""
+        return MultiValue(self.characters_in(self.domains[seat]))
+
+    def fixed(self, seat):
+        """The character seat must be, or None if there's more than one option."""
+        domain = self.domains[seat]
+        return self.characters[domain.bit_length() - 1] if single(domain) else None
+
+    def in_play(self, character):
+        """MultiValue of whether this character is in play: True, False or both.
+
+Only as exact as propagation; use assignments for certainty."""
+        bit = self.mask((character,))
+        ret = []
+        if any(domain & bit for domain in self.domains):
+            ret.append(True)
+        if bit not in self.domains:
+            ret.append(False)
+        return MultiValue(ret)
+
+    def assignments(self):
+        """Generate every possible world, as a tuple of the character in each seat.
+
+Searches by fixing the seat with fewest options, propagating after each choice."""
+        try:
+            state = self.copy().propagate()
+        except Contradiction:
+            return
+        yield from state._search()
+
+    def _search(self):
+        open_seats = [(domain.bit_count(), seat) for seat, domain in enumerate(self.domains) if not single(domain)]
+        if not open_seats:
+            yield tuple(self.fixed(seat) for seat in range(len(self.domains)))
+            return
+        _, seat = min(open_seats)
+        domain = self.domains[seat]
+        for i in range(domain.bit_length()):
+            if domain >> i & 1:
+                child = self.copy()
+                child.domains[seat] = 1 << i
+                try:
+                    child.propagate()
+                except Contradiction:
+                    continue
+                yield from child._search()
+
+
+def single(mask):
+    """Whether exactly one bit is set."""
+    return mask != 0 and not mask & (mask - 1)
+
+
+# Propagators
+# Each has propagate(superposition), which narrows domains and returns whether it changed any.
+
+class Unique(object):
+    """No two seats are the same character."""
+    def propagate(self, sp):
+        changed = False
+        done = 0
+        while True:
+            # Fixing seats can fix others in turn, so keep going until there are no new ones
+            fixed = [(seat, domain) for seat, domain in enumerate(sp.domains)
+                     if single(domain) and not done >> seat & 1]
+            if not fixed:
+                break
+            for seat, domain in fixed:
+                done |= 1 << seat
+                for other in range(len(sp.domains)):
+                    if other != seat and sp.domains[other] & domain:
+                        changed |= sp.exclude(other, domain)
+        union = 0
+        for domain in sp.domains:
+            union |= domain
+        if union.bit_count() < len(sp.domains):
+            raise Contradiction("Not enough characters to go round the seats.")
+        return changed
+
+
+class MustBe(object):
+    """seat is one of these characters; e.g. from what they were shown."""
+    def __init__(self, seat, characters):
+        self.seat = seat
+        self.characters = tuple(characters)
+
+    def propagate(self, sp):
+        return sp.restrict(self.seat, sp.mask(self.characters))
+
+
+class CannotBe(MustBe):
+    """seat is none of these characters."""
+    def propagate(self, sp):
+        return sp.exclude(self.seat, sp.mask(self.characters))
+
+
+class InPlay(object):
+    """Each of these characters is in play."""
+    def __init__(self, characters):
+        self.characters = tuple(characters)
+
+    def propagate(self, sp):
+        changed = False
+        for character in self.characters:
+            bit = sp.mask((character,))
+            seats = [seat for seat, domain in enumerate(sp.domains) if domain & bit]
+            if not seats:
+                raise Contradiction("{} must be in play, but no seat can be it.".format(character))
+            if len(seats) == 1:
+                changed |= sp.restrict(seats[0], bit)
+        return changed
+
+
+class NotInPlay(InPlay):
+    """None of these characters are in play."""
+    def propagate(self, sp):
+        mask = sp.mask(self.characters)
+        changed = False
+        for seat in range(len(sp.domains)):
+            changed |= sp.exclude(seat, mask)
+        return changed
+
+
+class Bluffs(NotInPlay):
+    """The demon's bluffs, which aren't in play."""
+
+
+class Allowed(object):
+    """The characters of these seats must satisfy predicate(*characters).
+
+For information involving a few seats; e.g. 'one of these two is the Washerwoman'.
+Keeps each option that is part of some allowed combination, trying every combination of the seats' options,
+  so should only be used with a small number of seats."""
+    def __init__(self, seats, predicate):
+        self.seats = tuple(seats)
+        self.predicate = predicate
+
+    def propagate(self, sp):
+        options = [[(1 << i, character) for i, character in enumerate(sp.characters) if sp.domains[seat] >> i & 1]
+                   for seat in self.seats]
+        supported = [0] * len(self.seats)
+        for combination in product(*options):
+            if self.predicate(*(character for _, character in combination)):
+                for n, (bit, _) in enumerate(combination):
+                    supported[n] |= bit
+        changed = False
+        for seat, mask in zip(self.seats, supported):
+            changed |= sp.restrict(seat, mask)
+        return changed
+
+
+class SetupCounts(object):
+    """The number of characters of each kind in play; e.g. {TOWNSFOLK: 5, OUTSIDER: 0, MINION: 1, DEMON: 1}.
+
+modifiers: character -> {kind: change}, for characters changing the setup when in play.
+  e.g. {Baron: {TOWNSFOLK: -2, OUTSIDER: 2}}
+Works out how many seats must and can be each kind, and which modifiers can be in play to match.
+When only one count is possible and it's at one of those limits, the other seats are decided."""
+    def __init__(self, counts, modifiers=None):
+        self.counts = dict(counts)
+        self.modifiers = dict(modifiers) if modifiers else {}
+
+    def propagate(self, sp):
+        kind_masks = {kind: sp.kind_mask(kind) for kind in self.counts}
+        lo = {kind: sum(1 for domain in sp.domains if not domain & ~mask) for kind, mask in kind_masks.items()}
+        hi = {kind: sum(1 for domain in sp.domains if domain & mask) for kind, mask in kind_masks.items()}
+        modifiers = list(self.modifiers.items())
+        choices = []
+        for character, _ in modifiers:
+            bit = sp.mask((character,))
+            if bit in sp.domains:
+                choices.append((True,))
+            elif not any(domain & bit for domain in sp.domains):
+                choices.append((False,))
+            else:
+                choices.append((False, True))
+        # Which combinations of modifiers being in play give counts that fit
+        feasible = []
+        for choice in product(*choices):
+            targets = dict(self.counts)
+            for (_, changes), on in zip(modifiers, choice):
+                if on:
+                    for kind, change in changes.items():
+                        targets[kind] = targets.get(kind, 0) + change
+            if all(lo[kind] <= target <= hi[kind] for kind, target in targets.items() if kind in lo):
+                feasible.append((choice, targets))
+        if not feasible:
+            raise Contradiction("No setup fits the character counts.")
+        changed = False
+        for n, (character, _) in enumerate(modifiers):
+            if all(not choice[n] for choice, _ in feasible):
+                bit = sp.mask((character,))
+                for seat in range(len(sp.domains)):
+                    changed |= sp.exclude(seat, bit)
+            elif all(choice[n] for choice, _ in feasible):
+                changed |= InPlay((character,)).propagate(sp)
+        for kind, mask in kind_masks.items():
+            targets = {target[kind] for _, target in feasible}
+            if len(targets) != 1:
+                continue
+            target = targets.pop()
+            if target == hi[kind] and target != lo[kind]:
+                # Everyone who can be this kind is
+                for seat in range(len(sp.domains)):
+                    if sp.domains[seat] & mask:
+                        changed |= sp.restrict(seat, mask)
+            elif target == lo[kind] and target != hi[kind]:
+                # Only those who must be this kind are
+                for seat in range(len(sp.domains)):
+                    if sp.domains[seat] & ~mask:
+                        changed |= sp.exclude(seat, mask)
+        return changed
@@ -0,0 +1,139 @@
+from itertools import combinations
+
+from memo import LRUCache, MISSING
+from multivalue import *
+
+# Results of consistency checks kept per night, by the full set of choices checked
+CHECK_CACHE_SIZE = 65536
+
+class RechoiceResult(object):
+    """The fewest players who need to re-choose, and what they can choose instead.
+
+players: tuple of players to wake again, or None if no re-choice by up to max_rechoices players works
+options: player -> MultiValue of the new choices they can make, in some consistent world
+others: other sets of players, of the same size, that would also work"""
+    def __init__(self, players, options=None, others=()):
+        self.players = players
+        self.options = options if options else {}
+        self.others = list(others)
+
+    def __str__(self):
+        if self.players is None:
+            return "RechoiceResult(no re-choice works)"
+        return "RechoiceResult({} to re-choose)".format(len(self.players))
+
+
+class RechoiceSolver(object):
+    """Finds the fewest players who need to change their night choices to make them consistent.
+
+choices: player -> the choice they submitted
+alternatives: player -> the other choices they could make
+check(choices): True if the choices are consistent. Otherwise False, or better, the players whose choices conflict.
+Tries 0 re-choices, then 1, then 2, and so on (iterative deepening), so the first answer is minimal.
+Every conflict found is learnt as a nogood: a set of (player, choice) pairs that can't all happen.
+  Sets of players that don't include someone from every nogood among the submitted choices are skipped,
+  and partial re-choices containing a nogood are cut off before checking.
+Nogoods and check results are facts about the night, so are kept when a player resubmits;
+  re-resolving then mostly reuses them. Call new_night to forget them."""
+    def __init__(self, choices, alternatives, check, max_rechoices=None):
+        self.choices = dict(choices)
+        self.alternatives = {player: list(options) for player, options in alternatives.items()}
+        self.check = check
+        self.max_rechoices = max_rechoices
+        self.nogoods = set() # frozensets of (player, choice)
+        self._checked = LRUCache(CHECK_CACHE_SIZE)
+        self.checks = 0 # Calls of check, for seeing how much the nogoods save
+
+    def new_night(self, choices, alternatives):
+        """Start again with new choices, forgetting everything learnt."""
+        self.__init__(choices, alternatives, self.check, self.max_rechoices)
+
+    def resubmit(self, player, choice, alternatives=None):
+        """player has re-chosen. Returns the new result of solve."""
+        self.choices[player] = choice
+        if alternatives is not None:
+            self.alternatives[player] = list(alternatives)
+        return self.solve()
+
+    def solve(self):
+        """RechoiceResult for the current choices."""
+        players = list(self.choices)
+        limit = len(players) if self.max_rechoices is None else min(self.max_rechoices, len(players))
+        for count in range(limit + 1):
+            working = []
+            for subset in combinations(players, count):
+                if not self._could_fix(subset):
+                    continue
+                if self._completions(subset, first_only=True):
+                    working.append(subset)
+            if working:
+                best = working[0]
+                options = {}
+                for completion in self._completions(best):
+                    for player in best:
+                        options.setdefault(player, []).append(completion[player])
+                return RechoiceResult(best, {player: MultiValue(found, rem_dups=True) for player, found in options.items()},
+                                      working[1:])
+        return RechoiceResult(None)
+
+    def consistent(self, choices):
+        """Whether these choices (player -> choice) are consistent, learning a nogood if not."""
+        key = frozenset(choices.items())
+        ret = self._checked.get(key)
+        if ret is not MISSING:
+            return ret
+        if any(nogood <= key for nogood in self.nogoods):
+            ret = False
+        else:
+            self.checks += 1
+            result = self.check(dict(choices))
+            ret = result is True
+            if not ret:
+                conflict = result if result else choices
+                self._learn(frozenset((player, choices[player]) for player in conflict))
+        self._checked.put(key, ret)
+        return ret
+
+    def _learn(self, nogood):
+        # Smaller nogoods make larger ones redundant
+        if any(known <= nogood for known in self.nogoods):
+            return
+        self.nogoods = {known for known in self.nogoods if not nogood <= known}
+        self.nogoods.add(nogood)
+
+    def _could_fix(self, subset):
+        """Whether re-choosing by these players could avoid every conflict already known."""
+        subset = set(subset)
+        for nogood in self.nogoods:
+            if all(player not in subset and self.choices.get(player, MISSING) == choice for player, choice in nogood):
+                return False
+        return True
+
+    def _completions(self, subset, first_only=False):
+        """Consistent choices where the players in subset all choose something else.
+
+Returns a list of them (just the first one if first_only)."""
+        ret = []
+        current = dict(self.choices)
+        def search(i):
+            if i == len(subset):
+                if self.consistent(current):
+                    ret.append(dict(current))
+                    return first_only
+                return False
+            player = subset[i]
+            for choice in self.alternatives.get(player, ()):
+                if choice == self.choices[player]:
+                    continue
+                current[player] = choice
+                # Cut off as soon as a known conflict is chosen, among players already decided
+                decided = set(subset[:i + 1])
+                if any(all(current.get(p, MISSING) == c for p, c in nogood)
+                       and all(p in decided or p not in subset for p, _ in nogood) for nogood in self.nogoods):
+                    continue
+                if search(i + 1):
+                    return True
+            current[player] = self.choices[player]
+            return False
+        search(0)
+        return ret
@@ -1,7 +1,7 @@
 from typing import NamedTuple, Any
 
-class ReminderToken(NamedTuple):
-    """Reminder tokens."""
+class ReminderFields(NamedTuple):
+    """The fields of a reminder token. Use ReminderToken, which interns these."""
     character: Any # Associated Character class for this token
     type_: Any # Type of token; e.g. ABILITY_USED or DAY_X for Courtier
     text: str = "" # Text of the token. For niceness?
@@ -10,11 +10,108 @@ class ReminderToken(NamedTuple):
     poisons: bool = False # Does this token cause poisoning?
     # Not all get removed; e.g. ABILITY_USED
     droison_removes: bool = True
-    
-    @property
-    def droisons(self):
-        """Does this token cause droisoning on the recipient?"""
-        return self.drunks or self.poisons
+
+class ReminderToken(ReminderFields):
+    """Reminder tokens.
+
+Tokens are interned: making a token equal to an existing one gives back the same object.
+  So comparisons are usually just identity checks, and snapshots holding tokens share them.
+Each token has a small integer id, for indexing and bitsets (see TokenIndex),
+  and whether it droisons is worked out once."""
+    _interned = {} # ReminderFields -> token
+    _by_id = []
+
+    def __new__(cls, *args, **kwargs):
+        fields = ReminderFields(*args, **kwargs)
+        try:
+            ret = cls._interned.get(fields)
+        except TypeError:
+            # Unhashable fields can't be interned, but still get an id
+            return cls._new_token(fields)
+        if ret is None:
+            ret = cls._interned[fields] = cls._new_token(fields)
+        return ret
+
+    @classmethod
+    def _new_token(cls, fields):
+        ret = tuple.__new__(cls, fields)
+        ret.id = len(cls._by_id)
+        ret.droisons = fields.drunks or fields.poisons # Does this token cause droisoning on the recipient?
+        cls._by_id.append(ret)
+        return ret
+
+    @classmethod
+    def _make(cls, iterable):
+        # Also used by _replace, so changed copies are interned too
+        return cls(*iterable)
+
+    def __reduce__(self):
+        # Ids are per process, so intern again when unpickled
+        return (type(self), tuple(self))
 
     def __str__(self):
         return self.text
+
+def token_by_id(token_id):
+    """The reminder token with this id."""
+    return ReminderToken._by_id[token_id]
+
+
+class TokenIndex(object):
+    """Counts of reminder tokens by token, type and character, for quick lookups on a player.
+
+mask has bit i set if the token with id i is in the index."""
+    def __init__(self, tokens=()):
+        self._counts = {} # id -> count
+        self._types = {}
+        self._characters = {}
+        self.mask = 0
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token):
+        count = self._counts.get(token.id, 0)
+        self._counts[token.id] = count + 1
+        if not count:
+            self.mask |= 1 << token.id
+        self._types[token.type_] = self._types.get(token.type_, 0) + 1
+        self._characters[token.character] = self._characters.get(token.character, 0) + 1
+
+    def remove(self, token):
+        count = self._counts.get(token.id, 0)
+        if not count:
+            raise ValueError("Reminder token " + str(token) + " not in index.")
+        if count == 1:
+            del self._counts[token.id]
+            self.mask &= ~(1 << token.id)
+        else:
+            self._counts[token.id] = count - 1
+        for counts, key in ((self._types, token.type_), (self._characters, token.character)):
+            if counts[key] == 1:
+                del counts[key]
+            else:
+                counts[key] -= 1
+
+    def count(self, token):
+        return self._counts.get(token.id, 0)
+
+    def has_type(self, type_):
+        return type_ in self._types
+
+    def has_character(self, character):
+        """Whether there are any tokens for this character."""
+        return character in self._characters
+
+    def copy(self):
+        ret = TokenIndex()
+        ret._counts = dict(self._counts)
+        ret._types = dict(self._types)
+        ret._characters = dict(self._characters)
+        ret.mask = self.mask
+        return ret
+
+    def __contains__(self, token):
+        return token.id in self._counts
+
+    def __len__(self):
+        return sum(self._counts.values())
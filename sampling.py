@@ -0,0 +1,126 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError
+
+from propagation import *
+
+# Samples are taken in fixed chunks, each with its own seed, so the results only depend on the seed
+#  and the number of samples; not on how many workers there are or which finishes first.
+CHUNK_SIZE = 256
+
+class SampleResult(object):
+    """What was seen in the sampled worlds: how many were tried and found, and how often each seat was each character."""
+    def __init__(self, characters, seats):
+        self.characters = list(characters)
+        self.tried = 0
+        self.found = 0
+        self.chunks = 0 # Number of chunks merged in; fewer than asked for if the time limit was hit
+        self.counts = [[0] * len(self.characters) for _ in range(seats)]
+
+    def merge(self, chunk_result):
+        tried, found, counts = chunk_result
+        self.tried += tried
+        self.found += found
+        self.chunks += 1
+        for mine, theirs in zip(self.counts, counts):
+            for i, count in enumerate(theirs):
+                mine[i] += count
+
+    def options(self, seat):
+        """MultiValue of the characters seat was in any sampled world."""
+        return MultiValue([character for character, count in zip(self.characters, self.counts[seat]) if count])
+
+    def all_options(self):
+        return [self.options(seat) for seat in range(len(self.counts))]
+
+    def frequencies(self, seat):
+        """Dict of character -> fraction of the found worlds that seat was that character in."""
+        if not self.found:
+            return {}
+        return {character: count / self.found
+                for character, count in zip(self.characters, self.counts[seat]) if count}
+
+    def __str__(self):
+        return "SampleResult({} found from {} tried)".format(self.found, self.tried)
+
+
+def sample_worlds(superposition, samples=10000, seed=0, workers=None, time_limit=None, check=None,
+                  executor=None):
+    """Resolve by sampling: find possible worlds at random, and see what each seat can be.
+
+Each sample fixes the seats one at a time in a random order, picking a random option and propagating;
+  samples that hit a contradiction are thrown away. This isn't uniform over worlds, but finds
+  possibilities far quicker than enumerating them.
+check: optional check(world) -> bool for consistency beyond the propagators; world is a tuple of characters.
+Runs over a process pool of workers (or the given executor). workers=1 runs here, with no pool.
+  The superposition (including propagator predicates) and check must be picklable for a pool.
+The same seed and samples always give the same result, however many workers there are,
+  unless time_limit (seconds) runs out first; then only the chunks that finished are merged."""
+    seats = len(superposition.domains)
+    chunks = sample_chunks(samples)
+    deadline = time.monotonic() + time_limit if time_limit is not None else None
+    ret = SampleResult(superposition.characters, seats)
+    if executor is None and workers == 1:
+        for chunk, count in chunks:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            ret.merge(sample_chunk(superposition, seed, chunk, count, check))
+        return ret
+    pool = executor if executor is not None else ProcessPoolExecutor(workers)
+    futures = [pool.submit(sample_chunk, superposition, seed, chunk, count, check) for chunk, count in chunks]
+    try:
+        timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+        for future in as_completed(futures, timeout=timeout):
+            ret.merge(future.result())
+    except TimeoutError:
+        pass
+    finally:
+        for future in futures:
+            future.cancel()
+        if executor is None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    return ret
+
+def sample_chunks(samples):
+    """(chunk number, number of samples) for each chunk of this many samples."""
+    return [(chunk, min(CHUNK_SIZE, samples - chunk * CHUNK_SIZE))
+            for chunk in range((samples + CHUNK_SIZE - 1) // CHUNK_SIZE)]
+
+def sample_chunk(superposition, seed, chunk, count, check=None):
+    """Take count samples for this chunk. Returns (tried, found, per-seat counts of each character)."""
+    rng = random.Random("{}:{}".format(seed, chunk))
+    seats = len(superposition.domains)
+    counts = [[0] * len(superposition.characters) for _ in range(seats)]
+    found = 0
+    try:
+        base = superposition.copy().propagate()
+    except Contradiction:
+        return (count, 0, counts)
+    for _ in range(count):
+        world = sample_world(base, rng)
+        if world is None:
+            continue
+        ids = [domain.bit_length() - 1 for domain in world]
+        if check is not None and not check(tuple(superposition.characters[i] for i in ids)):
+            continue
+        found += 1
+        for seat, i in enumerate(ids):
+            counts[seat][i] += 1
+    return (count, found, counts)
+
+def sample_world(superposition, rng):
+    """One random world from an already propagated superposition, as each seat's domain bit; or None."""
+    state = superposition.copy()
+    seats = list(range(len(state.domains)))
+    rng.shuffle(seats)
+    for seat in seats:
+        domain = state.domains[seat]
+        if single(domain):
+            continue
+        bits = [1 << i for i in range(domain.bit_length()) if domain >> i & 1]
+        state.domains[seat] = rng.choice(bits)
+        try:
+            state.propagate()
+        except Contradiction:
+            return None
+    return tuple(state.domains)
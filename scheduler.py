@@ -0,0 +1,127 @@
+from typing import NamedTuple, Any
+
+from botctime import *
+
+class NightChoice(NamedTuple):
+    """What a player chose to do tonight.
+
+options are (character, choice) pairs in order of preference, each happening at that character's minute.
+  If one turns out to be impossible when it's reached, the next is used instead (Law 6);
+  this can be earlier in the night than the first attempt would have been."""
+    player: Any
+    options: tuple = ()
+
+
+class NightResult(object):
+    """What happened when a night was run.
+
+chosen: player -> the (character, choice) used, or None if none of their options were possible
+rejected: player -> options found to be impossible, in the order tried
+times: player -> BOTCTime their chosen option happened, or their last option was rejected
+skipped: NightChoices with no options for characters that act, or that no remaining world contains"""
+    def __init__(self):
+        self.chosen = {}
+        self.rejected = {}
+        self.times = {}
+        self.skipped = []
+
+    def needs_rechoice(self):
+        """Players none of whose options were possible."""
+        return [player for player, choice in self.chosen.items() if choice is None]
+
+
+class NightOrder(object):
+    """A script's night order, compiled once into a table of minute -> characters acting then.
+
+Each character's minute is its 'night_order' attribute (or 'first_night_order' for the first night),
+  or given by order(character). Characters without one don't act at night.
+Running a night only visits minutes someone is acting in, so the clock isn't ticked through empty ones."""
+    def __init__(self, characters, first_night=False, order=None):
+        if order is None:
+            name = "first_night_order" if first_night else "night_order"
+            order = lambda character: getattr(character, name, None)
+        self.minutes = {} # character -> minute
+        by_minute = {}
+        for character in characters:
+            minute = order(character)
+            if minute is None:
+                continue
+            if minute <= DUSK:
+                raise ValueError("Night order of {} must be after dusk, not {}.".format(character, minute))
+            self.minutes[character] = minute
+            by_minute.setdefault(minute, []).append(character)
+        self.table = [(minute, tuple(by_minute[minute])) for minute in sorted(by_minute)]
+
+    def minute(self, character):
+        """Minute this character acts in, or None if it doesn't."""
+        return self.minutes.get(character)
+
+    def occupied(self, candidates=None):
+        """(minute, characters) for the minutes someone acts in; only characters in candidates, if given."""
+        if candidates is None:
+            return list(self.table)
+        candidates = set(candidates)
+        ret = []
+        for minute, characters in self.table:
+            characters = tuple(character for character in characters if character in candidates)
+            if characters:
+                ret.append((minute, characters))
+        return ret
+
+    def run(self, clock, submissions, feasible, candidates=None):
+        """Run tonight's actions in order, taking each player's first possible option.
+
+clock must be at some point in a night, no later than the first option of anyone acting; actions happen
+  at their minute of that night. The clock is only moved forwards, to minutes someone is waiting in,
+  and is left at the last one.
+feasible(submission, option, time) says whether an option is possible at that point in the night;
+  it's only called on options up to the first possible one. A fallback for an earlier minute than the option
+  it replaces is checked straight away, at its own (earlier) time, without moving the clock back.
+candidates: characters some remaining world contains. Options for others are impossible, so are rejected
+  without calling feasible."""
+        if not clock.now.night:
+            raise ValueError("Can only run a night at night, not " + str(clock.now) + ".")
+        hour, start = clock.now.h, clock.now.m
+        candidates = set(candidates) if candidates is not None else None
+        result = NightResult()
+        waiting = {} # character -> [(submission number, option number)] to try at its minute
+        def acts(character):
+            return character in self.minutes and (candidates is None or character in candidates)
+        def attempt(i, k, now):
+            """Try submission i's options from option k, up to the minute now; later ones wait for their minute."""
+            submission = submissions[i]
+            rejected = result.rejected[submission.player]
+            for option in submission.options[k:]:
+                character = option[0]
+                if acts(character):
+                    minute = self.minutes[character]
+                    if minute > now:
+                        waiting.setdefault(character, []).append((i, k))
+                        return
+                    time = BOTCTime(hour, minute)
+                    result.times[submission.player] = time
+                    if feasible(submission, option, time):
+                        result.chosen[submission.player] = option
+                        return
+                rejected.append(option)
+                k += 1
+            result.chosen[submission.player] = None
+        for i, submission in enumerate(submissions):
+            first = next((option for option in submission.options if acts(option[0])), None)
+            if first is None:
+                result.skipped.append(submission)
+                continue
+            if self.minutes[first[0]] < start:
+                raise ValueError("Can't run the night from {}; {} acts earlier, at minute {}.".format(
+                    clock.now, first[0], self.minutes[first[0]]))
+            result.rejected[submission.player] = []
+            attempt(i, 0, start - 1)
+        for minute, characters in self.occupied(candidates):
+            if minute < start or not any(character in waiting for character in characters):
+                continue
+            if clock.now.m != minute:
+                clock.set(BOTCTime(hour, minute))
+            for character in characters:
+                for i, k in waiting.pop(character, ()):
+                    attempt(i, k, minute)
+        return result
@@ -0,0 +1,300 @@
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from player_state import *
+from sampling import *
+
+# Asyncio front end hosting many storyteller sessions at once, over JSON lines on a local socket.
+# Each request is one JSON object per line, with an "op", usually a "session", and optionally an "id"
+#  that is copied into the response. Responses are {"ok": true, ...} or {"ok": false, "error": ...}.
+# Requests on a connection are handled concurrently, so a long resolve doesn't hold up anything else.
+# Resolving runs in a process pool shared by all sessions; see StorytellerServer.
+
+CONSTRAINTS = {
+    "must_be": lambda request: MustBe(request["seat"], request["characters"]),
+    "cannot_be": lambda request: CannotBe(request["seat"], request["characters"]),
+    "in_play": lambda request: InPlay(request["characters"]),
+    "not_in_play": lambda request: NotInPlay(request["characters"]),
+    "bluffs": lambda request: Bluffs(request["characters"]),
+}
+
+class Session(object):
+    """One game: its clock, players, what's known about who they are, and the night's submitted choices."""
+    def __init__(self, name, seats, characters, kinds=None, counts=None):
+        self.name = name
+        self.clock = Clock()
+        self.players = [Player(None, seat, clock=self.clock) for seat in range(seats)]
+        self.superposition = Superposition(seats, characters, kinds).add(Unique())
+        if counts:
+            self.superposition.add(SetupCounts(counts))
+        self.choices = {} # seat -> (choice submitted tonight, characters that could have made it or None)
+        self.options = None # Options per seat from the last resolve
+        self.resolving = [] # Jobs for the current resolve's chunks
+
+    def choice_constraints(self):
+        """The superposition, plus tonight's choices: each seat must be a character that could have made theirs."""
+        ret = self.superposition.copy()
+        for seat, (_, characters) in sorted(self.choices.items()):
+            if characters is not None:
+                ret.add(MustBe(seat, characters))
+        return ret
+
+    def state(self):
+        return {"time": str(self.clock.now), "alive": [player.alive for player in self.players],
+                "choices": {str(seat): choice for seat, (choice, _) in self.choices.items()}, "options": self.options}
+
+
+class Job(object):
+    """Work for the process pool, queued per session."""
+    def __init__(self, session, fn, args):
+        self.session = session
+        self.fn = fn
+        self.args = args
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class StorytellerServer(object):
+    """Hosts many independent sessions, sharing one process pool for resolving.
+
+Jobs are queued per session and started round robin between sessions, with at most one per worker
+  running at once, so a session asking for lots of work can't starve the others.
+  A resolve is one job per chunk of samples (see sampling.sample_chunk), merged here as they finish.
+A session only ever has one resolve going: resubmitting a choice that changes who the player could be
+  (or resolving again) cancels the last one.
+  Cancelled chunks that haven't started never run; ones already running finish in their worker,
+  but their results are thrown away. So a cancelled resolve holds on to at most one worker per chunk running."""
+    def __init__(self, workers=None, executor=None):
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        if executor is None:
+            # Forked workers would inherit open connections, so closing one wouldn't reach the client
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+        self.executor = executor
+        self.sessions = {}
+        self._queues = {} # session name -> deque of Jobs
+        self._order = deque() # Session names with queued jobs, in turn order
+        self._running = 0
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening, returning the port (useful with port=0, which picks a free one)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # Connections
+
+    async def _handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        async def respond(line):
+            request = None
+            try:
+                request = json.loads(line)
+                response = await self.dispatch(request)
+            except asyncio.CancelledError:
+                response = {"ok": False, "error": "cancelled"}
+            except Exception as e:
+                response = {"ok": False, "error": "{}: {}".format(type(e).__name__, e)}
+            if isinstance(request, dict) and "id" in request:
+                response["id"] = request["id"]
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.create_task(respond(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    # Requests
+
+    async def dispatch(self, request):
+        op = request.get("op")
+        if op == "open":
+            name = request["session"]
+            if name in self.sessions:
+                raise ValueError("Session " + str(name) + " is already open.")
+            counts = request.get("counts")
+            if counts:
+                # JSON object keys are always strings, but kinds are ints
+                counts = {int(kind): count for kind, count in counts.items()}
+            self.sessions[name] = Session(name, request["seats"], request["characters"],
+                                          request.get("kinds"), counts)
+            return {"ok": True}
+        session = self._session(request)
+        if op == "close":
+            self._cancel(session)
+            del self.sessions[session.name]
+            for job in self._queues.pop(session.name, ()):
+                job.future.cancel()
+            if session.name in self._order:
+                self._order.remove(session.name)
+            return {"ok": True}
+        if op == "constrain":
+            if request["type"] not in CONSTRAINTS:
+                raise ValueError("Unknown constraint type " + str(request["type"]) + ".")
+            session.superposition.add(CONSTRAINTS[request["type"]](request))
+            return {"ok": True}
+        if op == "tick":
+            session.clock.tick(*request.get("by", (0, 1, 0)))
+            return {"ok": True, "time": str(session.clock.now)}
+        if op == "kill":
+            session.players[request["seat"]].alive = False
+            return {"ok": True}
+        if op == "submit":
+            # "characters": those who could have made this choice, if it says anything about who the player is
+            characters = request.get("characters")
+            characters = tuple(characters) if characters is not None else None
+            _, before = session.choices.get(request["seat"], (None, None))
+            session.choices[request["seat"]] = (request["choice"], characters)
+            if characters != before:
+                # New information, so any resolve in progress is out of date
+                self._cancel(session)
+            return {"ok": True}
+        if op == "resolve":
+            return await self._resolve(session, request.get("samples", 1000), request.get("seed", 0))
+        if op == "state":
+            return dict(session.state(), ok=True)
+        raise ValueError("Unknown op " + str(op) + ".")
+
+    def _session(self, request):
+        try:
+            return self.sessions[request["session"]]
+        except KeyError:
+            raise ValueError("No session " + str(request.get("session")) + ".")
+
+    async def _resolve(self, session, samples, seed):
+        self._cancel(session)
+        superposition = session.choice_constraints()
+        jobs = [self.submit(session.name, sample_chunk, superposition, seed, chunk, count)
+                for chunk, count in sample_chunks(samples)]
+        session.resolving = jobs
+        result = SampleResult(superposition.characters, len(superposition.domains))
+        for job in jobs:
+            result.merge(await job.future)
+        if session.resolving is jobs:
+            session.resolving = []
+        options = [list(result.options(seat)) for seat in range(len(superposition.domains))]
+        session.options = options
+        return {"ok": True, "found": result.found, "tried": result.tried, "options": options}
+
+    def _cancel(self, session):
+        jobs = set(session.resolving)
+        session.resolving = []
+        for job in jobs:
+            job.future.cancel()
+        queue = self._queues.get(session.name)
+        if queue and jobs:
+            self._queues[session.name] = deque(job for job in queue if job not in jobs)
+
+    # Fair scheduling of pool work
+
+    def submit(self, session_name, fn, *args):
+        """Queue fn(*args) to run in the pool for this session. Returns the Job; await job.future."""
+        job = Job(session_name, fn, args)
+        queue = self._queues.setdefault(session_name, deque())
+        if not queue and session_name not in self._order:
+            self._order.append(session_name)
+        queue.append(job)
+        self._pump()
+        return job
+
+    def _pump(self):
+        """Start queued jobs, taking turns between sessions, while there are free workers."""
+        loop = asyncio.get_running_loop()
+        while self._running < self.workers and self._order:
+            name = self._order.popleft()
+            queue = self._queues.get(name)
+            if not queue:
+                continue
+            job = queue.popleft()
+            if queue:
+                self._order.append(name)
+            if job.future.cancelled():
+                continue
+            self._running += 1
+            pool_future = loop.run_in_executor(self.executor, job.fn, *job.args)
+            pool_future.add_done_callback(lambda done, job=job: self._finished(job, done))
+
+    def _finished(self, job, done):
+        self._running -= 1
+        if not job.future.done():
+            if done.cancelled():
+                job.future.cancel()
+            elif done.exception() is not None:
+                job.future.set_exception(done.exception())
+            else:
+                job.future.set_result(done.result())
+        self._pump()
+
+
+class Client(object):
+    """Simple client for talking to a StorytellerServer; e.g. for testing against localhost."""
+    def __init__(self):
+        self._ids = itertools.count()
+        self._waiting = {}
+        self._reader = self._writer = self._listener = None
+
+    async def connect(self, port, host="127.0.0.1"):
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self._listener = asyncio.create_task(self._listen())
+        return self
+
+    async def _listen(self):
+        while line := await self._reader.readline():
+            response = json.loads(line)
+            future = self._waiting.pop(response.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+
+    async def call(self, op, **request):
+        """Send a request and wait for its response."""
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        self._writer.write((json.dumps(dict(request, op=op, id=request_id)) + "\n").encode())
+        await self._writer.drain()
+        return await future
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        if self._listener is not None:
+            self._listener.cancel()
+
+
+async def serve(port=8765, workers=None):
+    server = StorytellerServer(workers)
+    port = await server.start(port=port)
+    print("Listening on 127.0.0.1:{}".format(port))
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+if __name__ == "__main__":
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8765))
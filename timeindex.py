@@ -0,0 +1,265 @@
+import weakref
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple, Any
+
+# Indexes of things that happened at BOTCTimes, for looking up everything in a time range.
+# Only uses the packed ordinal of times, so doesn't need to import botctime.
+
+class TimeIndex(object):
+    """Entries sorted by time, so ranges can be found in log time plus the number of results.
+
+Entries at the same time are kept in the order given by their sequence numbers.
+Adding in time order (the usual case) is an append; earlier times are inserted in place."""
+    def __init__(self):
+        self._keys = [] # (ordinal, sequence number)
+        self._entries = []
+
+    def add(self, time, seq, entry):
+        key = (time.ord, seq)
+        if not self._keys or key > self._keys[-1]:
+            self._keys.append(key)
+            self._entries.append(entry)
+        else:
+            i = bisect_right(self._keys, key)
+            self._keys.insert(i, key)
+            self._entries.insert(i, entry)
+
+    def _span(self, start=None, end=None, include_start=True):
+        """(first, last + 1) positions of entries in this time range."""
+        if start is None:
+            lo = 0
+        elif include_start:
+            lo = bisect_left(self._keys, (start.ord,))
+        else:
+            lo = bisect_left(self._keys, (start.ord + 1,))
+        hi = len(self._keys) if end is None else bisect_left(self._keys, (end.ord + 1,))
+        return lo, hi
+
+    def between(self, start=None, end=None, include_start=True):
+        """Generate entries from start to end (inclusive; None for no limit), in time order."""
+        lo, hi = self._span(start, end, include_start)
+        entries = self._entries
+        for i in range(lo, hi):
+            yield entries[i]
+
+    def count(self, start=None, end=None, include_start=True):
+        lo, hi = self._span(start, end, include_start)
+        return max(hi - lo, 0)
+
+    def keep_where(self, predicate):
+        """Drop the entries predicate is False for. Makes new lists, so generators already running aren't affected."""
+        kept = [(key, entry) for key, entry in zip(self._keys, self._entries) if predicate(entry)]
+        self._keys = [key for key, _ in kept]
+        self._entries = [entry for _, entry in kept]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+
+class WeakRefs(object):
+    """Weak references to logged objects, so logging something doesn't keep it alive.
+
+on_death(key) is called with the id of each object once it is freed.
+Objects that can't be weakly referenced are kept alive instead."""
+    def __init__(self, on_death):
+        self._refs = {} # id -> reference
+        self._on_death = on_death
+
+    def ref(self, obj):
+        """A reference to obj: calling it gives obj, or None once obj has been freed."""
+        key = id(obj)
+        ref = self._refs.get(key)
+        if ref is not None and ref() is obj:
+            return ref
+        try:
+            ref = weakref.ref(obj, lambda ref, key=key: self._died(key, ref))
+        except TypeError:
+            ref = lambda obj=obj: obj
+        self._refs[key] = ref
+        return ref
+
+    def _died(self, key, ref):
+        if self._refs.get(key) is ref:
+            del self._refs[key]
+            self._on_death(key)
+
+
+class Change(NamedTuple):
+    """A change to a timelined object."""
+    time: Any # BOTCTime of the change
+    obj: Any # Timelined object that changed
+    attr: Any = None # Attribute or method that changed it, if known
+
+
+class ChangeLog(object):
+    """Every change to the timelined objects using a clock, indexed by time and by object.
+
+Changes to timelined containers held in another object's ss_attrs are logged against
+  that object, with the attribute name; e.g. a player's reminders changing.
+"Everything that changed between t1 and t2" is then one lookup, rather than checking each object.
+Objects are only weakly referenced, so e.g. discarded forks can be freed; their changes are then forgotten."""
+    def __init__(self):
+        self._all = TimeIndex() # Entries are (time, reference to object, attr)
+        self._by_obj = {} # id -> TimeIndex; objects can be unhashable
+        self._refs = WeakRefs(self._forget)
+        self._seq = 0
+        self._dead = 0 # Entries in _all for freed objects, dropped once they're half of it
+
+    def add(self, time, obj, attr=None):
+        entry = (time, self._refs.ref(obj), attr)
+        self._seq += 1
+        self._all.add(time, self._seq, entry)
+        index = self._by_obj.get(id(obj))
+        if index is None:
+            index = self._by_obj[id(obj)] = TimeIndex()
+        index.add(time, self._seq, entry)
+        return Change(time, obj, attr)
+
+    def _forget(self, key):
+        index = self._by_obj.pop(key, None)
+        if index is not None:
+            self._dead += len(index)
+            if self._dead * 2 > len(self._all):
+                self._all.keep_where(lambda entry: entry[1]() is not None)
+                self._dead = 0
+
+    @staticmethod
+    def _changes(entries):
+        for time, ref, attr in entries:
+            obj = ref()
+            if obj is not None:
+                yield Change(time, obj, attr)
+
+    def between(self, start=None, end=None, include_start=True):
+        """Generate all changes from start to end (inclusive), in time order."""
+        return self._changes(self._all.between(start, end, include_start))
+
+    def since(self, start, end=None):
+        """Generate all changes after start, up to end (inclusive), in time order."""
+        return self._changes(self._all.between(start, end, include_start=False))
+
+    def of(self, obj, start=None, end=None, include_start=True):
+        """Generate changes to one object from start to end (inclusive), in time order."""
+        index = self._by_obj.get(id(obj))
+        if index is None:
+            return iter(())
+        return self._changes(index.between(start, end, include_start))
+
+    def changed(self, start=None, end=None, include_start=True):
+        """Dict of id -> (object, set of attributes) for everything that changed in this time range."""
+        ret = {}
+        for change in self.between(start, end, include_start):
+            entry = ret.get(id(change.obj))
+            if entry is None:
+                entry = ret[id(change.obj)] = (change.obj, set())
+            entry[1].add(change.attr)
+        return ret
+
+    def __len__(self):
+        return len(self._all) - self._dead
+
+
+class Event(NamedTuple):
+    """Something that happened, as stored in an EventLog."""
+    time: Any # BOTCTime it happened
+    event: Any # The event itself
+    obj: Any = None # Timelined object it was added to, if any
+    type_: Any = None # Type of event, for looking up by type
+    players: tuple = () # Players involved, for looking up by player
+
+
+class EventLog(object):
+    """Append-only store of events, indexed by time, by type of event and by players involved.
+
+Any number of events can happen at the same time; they are kept in the order they were added.
+Queries generate results lazily, in time order, and only look at the index they need.
+  e.g. all droisoning events on night 3: log.of_type(DROISONING, *hour_span(night(3)))
+By default, the type of an event is its 'type_' attribute if it has one (else its class),
+  and the players involved are its 'players' attribute if it has one.
+The object an event was added to is only weakly referenced; once it is freed, its events are forgotten.
+  Events and players are kept alive."""
+    def __init__(self):
+        self._all = TimeIndex() # Entries are Events, with a reference to the object in place of it
+        self._by_type = {}
+        self._by_player = {} # id -> TimeIndex
+        self._counts = {} # id of object -> number of its events
+        self._refs = WeakRefs(self._forget)
+        self._seq = 0
+        self._dead = 0 # Events of freed objects, dropped once they're half of them
+
+    def add(self, time, event, obj=None, type_=None, players=None):
+        """Add an event, returning the stored Event."""
+        if type_ is None:
+            type_ = getattr(event, "type_", type(event))
+        if players is None:
+            players = getattr(event, "players", ())
+        ret = Event(time, event, obj, type_, tuple(players))
+        entry = ret._replace(obj=None if obj is None else self._refs.ref(obj))
+        if obj is not None:
+            self._counts[id(obj)] = self._counts.get(id(obj), 0) + 1
+        self._seq += 1
+        self._all.add(time, self._seq, entry)
+        index = self._by_type.get(type_)
+        if index is None:
+            index = self._by_type[type_] = TimeIndex()
+        index.add(time, self._seq, entry)
+        for player in entry.players:
+            index = self._by_player.get(id(player))
+            if index is None:
+                index = self._by_player[id(player)] = TimeIndex()
+            index.add(time, self._seq, entry)
+        return ret
+
+    @staticmethod
+    def _alive(entry):
+        return entry.obj is None or entry.obj() is not None
+
+    def _forget(self, key):
+        self._dead += self._counts.pop(key, 0)
+        if self._dead * 2 > len(self._all):
+            for indexes in ({None: self._all}, self._by_type, self._by_player):
+                for index in indexes.values():
+                    index.keep_where(self._alive)
+            self._by_type = {k: index for k, index in self._by_type.items() if len(index)}
+            self._by_player = {k: index for k, index in self._by_player.items() if len(index)}
+            self._dead = 0
+
+    @classmethod
+    def _events(cls, entries):
+        for entry in entries:
+            if entry.obj is None:
+                yield entry
+            else:
+                obj = entry.obj()
+                if obj is not None:
+                    yield entry._replace(obj=obj)
+
+    def between(self, start=None, end=None):
+        """Generate all events from start to end (inclusive; None for no limit)."""
+        return self._events(self._all.between(start, end))
+
+    def of_type(self, type_, start=None, end=None):
+        """Generate events of this type from start to end (inclusive)."""
+        index = self._by_type.get(type_)
+        return self._events(index.between(start, end)) if index is not None else iter(())
+
+    def involving(self, player, start=None, end=None):
+        """Generate events involving this player from start to end (inclusive)."""
+        index = self._by_player.get(id(player))
+        return self._events(index.between(start, end)) if index is not None else iter(())
+
+    def copy(self):
+        """A separate log with the same events."""
+        ret = EventLog()
+        for entry in self:
+            ret.add(entry.time, entry.event, entry.obj, entry.type_, entry.players)
+        return ret
+
+    def __iter__(self):
+        return self._events(self._all)
+
+    def __len__(self):
+        return len(self._all) - self._dead
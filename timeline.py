@@ -1,17 +1,27 @@
 import functools
+from bisect import bisect_right, insort
+from operator import attrgetter
 
 from botctime import *
+from memo import LRUCache
 
-def timelined(ss_attrs=(), setters=()):
+# Times are bisected by their packed ordinal
+ORDINAL = attrgetter("ord")
+# How many states derived from a stored state (at a time between updates) each object remembers
+DERIVED_STATES = 32
+
+def timelined(ss_attrs=(), setters=(), keyframes=None):
     """Make an object remember its state as changes are made. Must be given a 'clock' attribute.
 
 Events can be stored in an 'events' attribute, for non-state change events.
   Events are not used by this decorator, but it provides support for them.
+  They are kept in an EventLog, which is append-only and indexed by time, type and players involved.
+  Events are also added to the clock's EventLog, for looking across all objects.
 Defines an 'at' method, which returns the state a specific time.
 Specify methods that can change states in 'setters'.
   These will then get an 'at' parameter (default to 'None' for current time).
   After running the state change, the new state will be generated and stored.
-States are stored in a 'states' attribute. This is lazily sorted on lookup.
+States are stored in a 'states' attribute. This is kept sorted as states are added.
   The state object is defined by the 'to_state' function (which looks at the current state).
   This object remembers the current time at creation.
   The returned object is a copy of the current state, referring to timelined objects if relevant.
@@ -19,8 +29,9 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
   These objects should be immutable, and must not be modified by any changes to their timelined form.
   If ss_attrs is defined, then the 'to_state' function is created. Otherwise it must be defined.
     The output of this function must define a copy method that allows changing the specific time.
-    The automatically created 'to_state' function returns a SnapshotAttrs which is given ss_attrs.
-    ss_attrs are then accessed by using 'at' after __getattr__.
+    The automatically created 'to_state' function returns a SnapshotAttrs subclass generated for ss_attrs.
+    This has slots for just those attributes; static values are read directly,
+      and timelined ones are passed through 'at' by __getattr__.
     This class copies all attributes from ss_attrs off the main object, after converting to a Snapshot form.
       Objects that already have an 'at' method are not converted to Snapshot form.
         This means that cyclic references are not a problem, since timelined objects are already in snapshot form.
@@ -36,27 +47,46 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
     TimelinedDict (return a SnapshotDict of their current state)
     TimelinedSet (return a SnapshotSet of the current state)
     These all need to wrap snapshot(_).at(self.time) around any returning functions
-  Static objects like int and str don't get a timelined version. Their timeline is traced in whatever they're an attribute of."""
+  Static objects like int and str don't get a timelined version. Their timeline is traced in whatever they're an attribute of.
+States can be stored as changes from the previous state, to save memory. Set keyframes to do this.
+  Every keyframes'th state is stored in full, and ones in between as a diff from the state before.
+  States are rebuilt from the nearest full state when looked up (and remembered for a while).
+  This can be changed per class or object by setting KEYFRAME_INTERVAL. None stores every state in full.
+  State objects need 'diff' and 'patch' methods to be stored this way; any that don't are stored in full.
+Defines a 'fork' method, which makes a copy sharing history and contents until one side changes them.
+  See Timeline.fork."""
     def class_wrapper(cls):
+        snapshot_cls = snapshot_class(ss_attrs, "Snapshot" + cls.__name__)
         @functools.wraps(cls, updated=())
         class Timeline(cls):
             """A timeline of a player or other object."""
             IS_TIMELINED = True
-            def __init__(self, *args, time=None, clock=None, **kwargs):
+            KEYFRAME_INTERVAL = keyframes
+            def __init__(self, *args, time=None, clock=None, owner=None, **kwargs):
                 self.setup(time, clock)
+                self._owner = owner
                 self.pause_updates() # Don't want __init__ to do state changes
                 super().__init__(*args, **kwargs)
                 self.resume_updates()
-                self.state_change(time) # Initial state
+                if owner is None:
+                    self.state_change(time) # Initial state
+                else:
+                    self._store_state(time) # The owner logs it being set, as a change to its attribute
                 
 
             def setup(self, time=None, clock=None):
                 self.clock = clock if clock else Clock()
                 self._states = {}
-                self._events = {} # Not actually used by this decorator.
+                self._eventlog = EventLog() # Not actually used by this decorator.
                 self._sttimes = []
-                self._evtimes = []
+                self._derived = LRUCache(DERIVED_STATES) # (state time, query time) -> state copy
                 self._paused = False
+                self._history_refs = [1] # Shared by forks with the same history containers
+                self._cow = {} # ss_attrs shared with a fork, taken out of __dict__ until used
+                self._shares = 0 # How many forked objects are sharing this one through _cow
+                self._pending = 0 # Forks of this whose owners' states still refer to this
+                self._rehome = None # Object this was forked from, while the owner's states still refer to that
+                self._owner = None # (object, attribute) this is held in, if in someone's ss_attrs
 
             # Methods specific to this wrapping
 
@@ -64,17 +94,101 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
                 """Current state of this object as a snapshot."""
                 if hasattr(super(), "to_state"):
                     return super().to_state()
-                return SnapshotAttrs(ss_attrs, self, self.clock.now)
+                return snapshot_cls(self, self.clock.now)
 
             def __setattr__(self, name, value):
                 # Need to stop people setting ss_attrs values to naked lists, sets or dicts
                 if name in ss_attrs:
+                    # No longer sharing anything here with a fork
+                    if name in self._cow:
+                        self._cow.pop(name)._shares -= 1
                     # Convert as needed
-                    super().__setattr__(name, self._tsafe(value))
-                    self.state_change()
+                    value = self._tsafe(value, owner=(self, name))
+                    if is_timelined(value):
+                        # Changes to it are logged as changes to this
+                        value._owner = (self, name)
+                    super().__setattr__(name, value)
+                    self.state_change(attr=name)
                 else:
                     super().__setattr__(name, value)
 
+            def __getattr__(self, name):
+                # Only called when not found normally; e.g. for ss_attrs still shared with a fork
+                cow = self.__dict__.get("_cow")
+                if not cow or name not in cow:
+                    if hasattr(super(), "__getattr__"):
+                        return super().__getattr__(name)
+                    raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+                # About to be used, so might be changed; stop sharing it
+                # Reading mustn't change history, so this object's states keep referring to the shared one
+                #  until the fork first changes (see state_change)
+                value = cow.pop(name)
+                value._shares -= 1
+                if value._shares or value._pending:
+                    # Still referred to by others, so must not change any more
+                    source = value
+                    value = source.fork()
+                    source._pending += 1
+                    value._rehome = source
+                value._owner = (self, name)
+                object.__setattr__(self, name, value)
+                return value
+
+            # Forking
+
+            def fork(self):
+                """A copy of this object, sharing history and contents until one side changes them.
+
+History is shared until either side stores a new state or event.
+  That side then copies the dict of states and its event log; the states themselves stay shared.
+Timelined objects in ss_attrs (e.g. lists of reminders) are shared until either side uses them,
+  at which point that side forks them in turn. Its states refer to the fork once that first changes,
+  so just reading them doesn't change history.
+  This is on first use, not first write: the container returned can be changed without going through
+    this object, so it must already be this object's own. Forking a container copies its contents.
+  Reading through at() or raw_attr doesn't count as using them.
+The fork uses the same clock. Timelined objects inside containers are shared, not forked.
+Classes can define a 'forked' method, which is called on the new object with the original,
+  to split up any other state they keep."""
+                ret = type(self).__new__(type(self))
+                self._fork_contents(ret)
+                ret.__dict__.update(self.__dict__)
+                ret._derived = LRUCache(DERIVED_STATES)
+                self._history_refs[0] += 1
+                ret._shares = 0
+                ret._pending = 0
+                ret._rehome = None
+                # Share timelined attributes lazily
+                ret._cow = dict(self._cow)
+                for value in self._cow.values():
+                    value._shares += 1
+                for name in ss_attrs:
+                    value = self.__dict__.get(name)
+                    if is_timelined(value):
+                        del self.__dict__[name]
+                        del ret.__dict__[name]
+                        self._cow[name] = value
+                        ret._cow[name] = value
+                        value._shares += 2
+                if hasattr(ret, "forked"):
+                    ret.forked(self)
+                return ret
+
+            def _fork_contents(self, ret):
+                """Copy the contents of builtin containers into a fork."""
+                if hasattr(super(), "_fork_contents"):
+                    super()._fork_contents(ret)
+
+            def _own_history(self):
+                """Stop sharing history containers with any forks, ready to change them."""
+                refs = self._history_refs
+                if refs[0] > 1:
+                    refs[0] -= 1
+                    self._history_refs = [1]
+                    self._states = dict(self._states)
+                    self._eventlog = self._eventlog.copy()
+                    self._sttimes = list(self._sttimes)
+
             # State has changed
 
             def pause_updates(self):
@@ -85,8 +199,29 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
             def resume_updates(self):
                 self._paused = False
 
-            def state_change(self, time=None):
+            def state_change(self, time=None, attr=None):
+                """Store the current state, logging the change with the clock.
+
+attr is the attribute or method that changed it, if known."""
                 if not self._paused:
+                    if self._owner is not None:
+                        owner, owner_attr = self._owner
+                        self.clock.changes.add(time if time else self.clock.now, owner, owner_attr)
+                        if self._rehome is not None:
+                            # Forked from a shared object; the owner's states need to refer to this now
+                            self._rehome._pending -= 1
+                            self._rehome = None
+                            owner._store_state(time)
+                    else:
+                        self.clock.changes.add(time if time else self.clock.now, self, attr)
+                    self._store_state(time)
+
+            def _store_state(self, time=None):
+                """Store the current state, or leave it to the transaction in progress."""
+                transaction = self.clock.transaction
+                if transaction is not None:
+                    transaction.defer(self, time)
+                else:
                     self.set_state(self.to_state(), time=time)
 
             # Getting state and event objects
@@ -94,25 +229,31 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
             @property
             def states(self):
                 """Ordered list of (time, state) tuples."""
-                return [(time, self._states[time]) for time in self._sttimes]
+                return [(time, self._state(time)) for time in self._sttimes]
 
             @property
             def events(self):
                 """Ordered list of (time, event) tuples."""
-                return [(time, self._events[time]) for time in self._evtimes]
+                return [(entry.time, entry.event) for entry in self._eventlog]
 
             def at(self, time=None):
                 """State at a specific time. By default checks current clock time."""
                 time = time if time else self.clock.now
-                # Assumption is that this will most often be looking at recent events
-                # So look backwards from the last event
-                for st_time in reversed(self._sttimes):
-                    if st_time <= time:
-                        state = self._states[st_time]
-                        if st_time != time:
-                            # TODO: memoise with set_state
-                            return state.copy(time=time)
-                        return state
+                i = bisect_right(self._sttimes, time.ord, key=ORDINAL)
+                if not i:
+                    return None
+                st_time = self._sttimes[i-1]
+                state = self._state(st_time)
+                if st_time == time:
+                    return state
+                # Between updates, so need a copy of the state at this time
+                # Remember these, so repeated lookups don't keep copying
+                key = (st_time, time)
+                derived = self._derived.get(key, None)
+                if derived is None:
+                    derived = state.copy(time=time)
+                    self._derived.put(key, derived)
+                return derived
 
             def now(self):
                 """Current state in this timeline."""
@@ -120,31 +261,31 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
 
             def latest(self):
                 """Latest state in this timeline. May be in the future if clock has been rewound."""
-                return self._states[self.last_update]
+                return self._state(self.last_update())
 
             def last_update(self):
                 """Time of last update to this object."""
                 return self._sttimes[-1]
 
             def states_during(self, start_time, end_time, states_only=True):
-                """All states seen between specified times."""
-                # TODO: this can't handle attributes having different
-                #       times when their state changed; it skips over those
+                """All states seen between specified times.
+
+Includes the times that timelined attributes (e.g. lists of reminders) changed, from the clock's change log."""
+                lo = bisect_right(self._sttimes, start_time.ord, key=ORDINAL)
+                hi = bisect_right(self._sttimes, end_time.ord, key=ORDINAL)
+                times = {time.ord: time for time in self._sttimes[lo:hi]}
+                for change in self.clock.changes.of(self, start_time, end_time, include_start=False):
+                    times[change.time.ord] = change.time
                 ret = [self.at(start_time)] if states_only else [(start_time, self.at(start_time))]
-                for time in self._sttimes:
-                    if time > start_time and time <= end_time:
-                        state = self._states[time]
-                        ret.append(state if states_only else (time, state))
+                for ordinal in sorted(times):
+                    state = self.at(times[ordinal])
+                    ret.append(state if states_only else (times[ordinal], state))
                 return ret
 
             def events_during(self, start_time, end_time, events_only=True):
                 """All events seen between specified times."""
-                ret = []
-                for time in self._evtimes:
-                    if time >= start_time and time <= end_time:
-                        event = self._events[time]
-                        ret.append(event if events_only else (time, event))
-                return ret
+                return [entry.event if events_only else (entry.time, entry.event)
+                        for entry in self._eventlog.between(start_time, end_time)]
 
             # Manual setters
 
@@ -155,28 +296,91 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
                 # Might work now with the change in at() to copy the state
                 #if state == self.at(time):
                 #    return
-                self._sttimes.append(time)
-                self._sttimes.sort()
-                self._states[time] = state
-
-            def add_event(self, event, time=None):
-                """Specify an event happening."""
+                self._own_history()
+                if self.KEYFRAME_INTERVAL:
+                    self._store_diff(state, time)
+                else:
+                    if time not in self._states:
+                        insort(self._sttimes, time, key=ORDINAL)
+                    self._states[time] = state
+                # Remembered copies from an earlier state to a time after this are now wrong
+                self._derived.remove_where(lambda key: key[0] <= time <= key[1])
+                if self.KEYFRAME_INTERVAL:
+                    # Likely to be the base of the next diff
+                    self._derived.put((time, time), state)
+
+            def add_event(self, event, time=None, type_=None, players=None):
+                """Specify an event happening. Any number of events can happen at the same time.
+
+type_ and players are used to index the event; see EventLog."""
                 time = time if time else self.clock.now
-                self._evtimes.append(time)
-                self._evtimes.sort()
-                self._events[time] = event
+                self._own_history()
+                entry = self._eventlog.add(time, event, self, type_, players)
+                self.clock.events.add(time, event, self, entry.type_, entry.players)
+
+            def events_of_type(self, type_, start_time=None, end_time=None):
+                """Generate (time, event) for events of this type between specified times."""
+                for entry in self._eventlog.of_type(type_, start_time, end_time):
+                    yield (entry.time, entry.event)
+
+            # Stored states
+
+            def _state(self, time):
+                """Full state stored at this time, rebuilding it from diffs if needed."""
+                stored = self._states[time]
+                if type(stored) is not StateDiff:
+                    return stored
+                key = (time, time)
+                state = self._derived.get(key, None)
+                if state is None:
+                    # Walk back to the last full state, then apply the diffs going forward
+                    i = bisect_right(self._sttimes, time.ord, key=ORDINAL) - 1
+                    diffs = []
+                    while type(stored) is StateDiff:
+                        diffs.append((self._sttimes[i], stored))
+                        i -= 1
+                        stored = self._states[self._sttimes[i]]
+                    state = stored
+                    for diff_time, diff in reversed(diffs):
+                        state = state.patch(diff.changes, diff_time)
+                    self._derived.put(key, state)
+                return state
+
+            def _store_diff(self, state, time):
+                """Store a state as a diff from the one before it if possible, or in full if not."""
+                i = bisect_right(self._sttimes, time.ord, key=ORDINAL)
+                replacing = i > 0 and self._sttimes[i-1] == time
+                if replacing:
+                    i -= 1
+                # The state after this one was stored as a diff from the one before; make it full
+                after = i + 1 if replacing else i
+                if after < len(self._sttimes):
+                    after = self._sttimes[after]
+                    self._states[after] = self._state(after)
+                stored = state
+                if i and hasattr(state, "diff"):
+                    before = self._sttimes[i-1]
+                    stored_before = self._states[before]
+                    depth = stored_before.depth + 1 if type(stored_before) is StateDiff else 1
+                    if depth < self.KEYFRAME_INTERVAL:
+                        changes = state.diff(self._state(before))
+                        if changes is not None:
+                            stored = StateDiff(changes, depth)
+                if not replacing:
+                    self._sttimes.insert(i, time)
+                self._states[time] = stored
 
             # Utility functions
 
-            def _tsafe(self, value):
-                """Timelined version of something."""
-                return to_timelined(value, clock=self.clock)
+            def _tsafe(self, value, owner=None):
+                """Timelined version of something. owner: (object, attribute) it's being put in, if any."""
+                return to_timelined(value, clock=self.clock, owner=owner)
 
         # Register all setting functions
         for setter in setters:
             def setter_wrap(self, *args, bound_setter_name=setter, **kwargs):
                 getattr(super(Timeline, self), bound_setter_name).__call__(*args, **kwargs)
-                self.state_change()
+                self.state_change(attr=bound_setter_name)
             setattr(Timeline, setter, setter_wrap)
         return Timeline
     return class_wrapper
@@ -184,8 +388,62 @@ States are stored in a 'states' attribute. This is lazily sorted on lookup.
 
 
 
+# Batching state changes
+
+class Transaction(object):
+    """Batch up state changes to all the timelined objects using a clock.
+
+Use as a context manager: 'with Transaction(clock):'
+  State changes inside it just mark the object as changed. When the transaction ends,
+  each changed object stores one state, however many times it was changed.
+  The new states are from the end of the transaction, at the time the change asked for (default now).
+  Until then, 'at' on a changed object doesn't see the changes.
+Transactions can be nested; inner ones join the outermost, which stores the states.
+If an exception is raised, the states are still stored, since the objects have changed anyway."""
+    def __init__(self, clock):
+        self.clock = clock
+        self.changed = {} # id -> (object, time); timelined lists etc. can't be hashed
+        self.outer = None
+
+    def __enter__(self):
+        self.outer = self.clock.transaction
+        if self.outer is None:
+            self.clock.transaction = self
+            return self
+        return self.outer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer is None:
+            self.clock.transaction = None
+            self.commit()
+        return False
+
+    def defer(self, obj, time=None):
+        """Mark an object as changed, to store its state at the end."""
+        self.changed[id(obj)] = (obj, time)
+
+    def commit(self):
+        """Store the states of all changed objects."""
+        changed = self.changed
+        self.changed = {}
+        for obj, time in changed.values():
+            # Changes were logged when they happened, so just store the state
+            obj.set_state(obj.to_state(), time=time)
+
+
 # Special snapshot and timelined objects
 
+# Stored instead of a full state, for timelined objects with keyframes
+class StateDiff(object):
+    __slots__ = ("changes", "depth")
+    def __init__(self, changes, depth):
+        self.changes = changes # From the state's diff method
+        self.depth = depth # How many diffs since the last full state
+
+def same_value(a, b):
+    """Whether two stored values can be treated as unchanged in a diff."""
+    return a is b or (type(a) is type(b) and type(a) in (int, float, str, bool) and a == b)
+
 # Not exposing the value except through at() should be fine, as this should only be found through containing objects
 class SnapshotStatic(object):
     TIMELINED = True
@@ -219,39 +477,109 @@ class SnapshotTuple(tuple):
         # Can't just pass self in as that will go through snapshot().at()
         # So take the real values
         return SnapshotTuple([super(SnapshotTuple, self).__getitem__(i) for i in range(len(self))], time=time if time else self.time)
+    def diff(self, base):
+        """(length of prefix shared with base, items after that), or None if base isn't a SnapshotTuple."""
+        if type(base) is not SnapshotTuple:
+            return None
+        mine = tuple(tuple.__iter__(self))
+        theirs = tuple(tuple.__iter__(base))
+        shared = 0
+        for x, y in zip(mine, theirs):
+            if not same_value(x, y):
+                break
+            shared += 1
+        return (shared, mine[shared:])
+    def patch(self, changes, time):
+        shared, rest = changes
+        return SnapshotTuple(tuple(tuple.__iter__(self))[:shared] + rest, time=time)
     def __str__(self):
         return str(tuple(self))
 
 # Mimics a class with attributes, passing values through snapshot and at before returning them
 class SnapshotAttrs(object):
+    """Base class for snapshots of objects with attributes. Use snapshot_class to get one for some attributes.
+
+Each attribute has two slots: its raw value, and a plain one that is only set for static values.
+  Static values are then read as normal slots.
+  Values that need passing through ssat (timelined objects and tuples) leave the plain slot unset,
+  so reading them falls back to __getattr__, which does that."""
+    __slots__ = ("time",)
     TIMELINED = True
-    def __init__(self, attrs, backer, time=None):
-        assert time
-        for attr in attrs:
-            setattr(self, attr, getattr(backer, attr, None))
-        self.attrs = set(attrs)
-        self.time = time
+    attrs = () # Set by snapshot_class
+    _raw_slots = {} # Attribute -> slot holding its raw value; set by snapshot_class
     def at(self, time=None):
         if time and time != self.time:
             return self.copy(time)
         return self
-    def __getattribute__(self, name):
-        normal = super().__getattribute__(name)
-        if name in self.attrs:
-            return ssat(normal, self.time)
-        return normal
+    def __getattr__(self, name):
+        # Only called when the plain slot isn't set
+        raw_slot = self._raw_slots.get(name)
+        if raw_slot is None:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        return ssat(raw_slot.__get__(self), self.time)
+    def _raw(self, attr):
+        return self._raw_slots[attr].__get__(self)
+    def _set_raw(self, attr, value):
+        """Set an attribute's raw value, and its plain value if it doesn't need resolving."""
+        self._raw_slots[attr].__set__(self, value)
+        if needs_ssat(value):
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                pass
+        else:
+            setattr(self, attr, value)
     def copy(self, time=None):
-        # Can't just set self as backer; would go through snapshot().at()
         # Can't just remember backer; that's been changed
         # So create it empty and then populate
-        ret = SnapshotAttrs((), self, time=time if time else self.time)
-        ret.attrs = set(self.attrs)
+        ret = type(self).__new__(type(self))
+        ret.time = time if time else self.time
         for attr in self.attrs:
-            setattr(ret, attr, super().__getattribute__(name))
+            ret._set_raw(attr, self._raw(attr))
+        return ret
+    def diff(self, base):
+        """Dict of attributes changed from base, or None if base isn't the same kind of snapshot."""
+        if type(base) is not type(self):
+            return None
+        changes = {}
+        for attr in self.attrs:
+            value = self._raw(attr)
+            if not same_value(value, base._raw(attr)):
+                changes[attr] = value
+        return changes
+    def patch(self, changes, time):
+        ret = self.copy(time)
+        for attr, value in changes.items():
+            ret._set_raw(attr, value)
         return ret
     def __str__(self):
         return str({attr:getattr(self, attr, None) for attr in self.attrs})
 
+def needs_ssat(value):
+    """Whether a value in a snapshot has to go through ssat when read."""
+    return type(value) in (tuple, list, set, dict) or is_timelined(value)
+
+def snapshot_class(attrs, name="SnapshotAttrs"):
+    """Make a SnapshotAttrs class with slots for these attributes.
+
+Its __init__(backer, time) copies the attributes off backer, and is generated so it doesn't loop."""
+    attrs = tuple(attrs)
+    raw_names = {attr: "_raw_" + attr for attr in attrs}
+    cls = type(name, (SnapshotAttrs,), {"__slots__": attrs + tuple(raw_names.values()), "attrs": attrs})
+    cls._raw_slots = {attr: getattr(cls, raw) for attr, raw in raw_names.items()}
+    lines = ["def __init__(self, backer, time):",
+             "    assert time",
+             "    self.time = time"]
+    for attr in attrs:
+        lines += ["    value = raw_attr(backer, {!r})".format(attr),
+                  "    self.{} = value".format(raw_names[attr]),
+                  "    if not needs_ssat(value):",
+                  "        self.{} = value".format(attr)]
+    namespace = {}
+    exec("\n".join(lines), globals(), namespace)
+    cls.__init__ = namespace["__init__"]
+    return cls
+
 # Used for TimelinedDict, but not otherwise exposed
 # TODO: Making read-only after creation
 # TODO: Other 'getter' methods
@@ -262,6 +590,9 @@ class SnapshotDict(dict):
         ret = dict.__new__(cls, *args, **kwargs)
         ret.time = time
         return ret
+    def __init__(self, *args, time=None, **kwargs):
+        # Keep time out of the dict's items
+        super().__init__(*args, **kwargs)
     def at(self, time=None):
         if time and time != self.time:
             return self.copy(time)
@@ -274,6 +605,21 @@ class SnapshotDict(dict):
         for key in self.keys():
             ret[key] = super().__getitem__(key)
         return ret
+    def diff(self, base):
+        """(changed items, removed keys), or None if base isn't a SnapshotDict."""
+        if type(base) is not SnapshotDict:
+            return None
+        changed = {key: value for key, value in dict.items(self)
+                   if key not in base or not same_value(value, dict.__getitem__(base, key))}
+        removed = tuple(key for key in dict.keys(base) if key not in self)
+        return (changed, removed)
+    def patch(self, changes, time):
+        changed, removed = changes
+        ret = self.copy(time)
+        for key in removed:
+            dict.__delitem__(ret, key)
+        dict.update(ret, changed)
+        return ret
     def __str__(self):
         return str(dict(self))
 
@@ -285,6 +631,9 @@ class SnapshotSet(set):
         ret = set.__new__(cls, *args, **kwargs)
         ret.time = time
         return ret
+    def __init__(self, *args, time=None, **kwargs):
+        # set doesn't take time as a keyword
+        super().__init__(*args, **kwargs)
     def at(self, time=None):
         if time and time != self.time:
             return self.copy(time)
@@ -300,6 +649,17 @@ class SnapshotSet(set):
         for item in super().__iter__():
             ret.add(item)
         return ret
+    def diff(self, base):
+        """(added items, removed items), or None if base isn't a SnapshotSet."""
+        if type(base) is not SnapshotSet:
+            return None
+        return (frozenset(set.difference(self, base)), frozenset(set.difference(base, self)))
+    def patch(self, changes, time):
+        added, removed = changes
+        ret = self.copy(time)
+        set.difference_update(ret, removed)
+        set.update(ret, added)
+        return ret
     def __str__(self):
         return str(set(self))
 
@@ -313,12 +673,14 @@ class SnapshotSet(set):
 # TODO: __delitem__, __iadd__, __imul__, insert
 # TODO: Work out which things need to be set to make sure everything goes through _tsafe
 class TimelinedList(list):
-    def __new__(cls, iterable=(), time=None, clock=None):
+    def __new__(cls, iterable=(), time=None, clock=None, owner=None):
         clock = clock if clock else Clock()
         ret = list.__new__(cls, [to_timelined(value, time=time, clock=clock) for value in iterable])
         return ret
     def to_state(self):
         return SnapshotTuple(self, time=self.clock.now)
+    def _fork_contents(self, ret):
+        list.extend(ret, self)
     def __setitem__(self, i, value):
         super().__setitem__(i, self._tsafe(value))
     def append(self, value):
@@ -329,23 +691,27 @@ class TimelinedList(list):
 @timelined(setters=("__setitem__","update","pop","clear",))
 # TODO: __delitem__, __ior__, editing items/keys, setdefault
 class TimelinedDict(dict):
-    def __new__(cls, *args, time=None, clock=None, **kwargs):
+    def __new__(cls, *args, time=None, clock=None, owner=None, **kwargs):
         # TODO: timelined internal values
         ret = dict.__new__(cls, *args, **kwargs)
         return ret
     def to_state(self):
         return SnapshotDict(self, time=self.clock.now)
+    def _fork_contents(self, ret):
+        dict.update(ret, self)
 
 @timelined(setters=("add","clear","difference_update","discard","intersection_update",
                     "pop","remove","symmetric_difference_update","update",))
 # TODO: __iand__, __ior__, __isub__, __ixor__
 class TimelinedSet(set):
-    def __new__(cls, *args, time=None, clock=None, **kwargs):
+    def __new__(cls, *args, time=None, clock=None, owner=None, **kwargs):
         # TODO: timelined internal values
         ret = set.__new__(cls, *args, **kwargs)
         return ret
     def to_state(self):
         return SnapshotSet(self, time=self.clock.now)
+    def _fork_contents(self, ret):
+        set.update(ret, self)
 
 
 # Utility and generic functions
@@ -354,20 +720,27 @@ def is_timelined(obj):
     """Is an object timelined?"""
     return getattr(obj, "IS_TIMELINED", False)
 
-def to_timelined(obj, time=None, clock=None):
-    """A timelined version of this object."""
+def to_timelined(obj, time=None, clock=None, owner=None):
+    """A timelined version of this object. owner: (object, attribute) it's being put in, if any."""
     if is_timelined(obj):
         return obj
     if type(obj) is list:
-        return TimelinedList(obj, time=time, clock=clock)
+        return TimelinedList(obj, time=time, clock=clock, owner=owner)
     if type(obj) is set:
-        return TimelinedSet(obj, time=time, clock=clock)
+        return TimelinedSet(obj, time=time, clock=clock, owner=owner)
     if type(obj) is dict:
-        return TimelinedDict(obj, time=time, clock=clock)
+        return TimelinedDict(obj, time=time, clock=clock, owner=owner)
     # TODO: Warn about non-int/str/tuple objects getting this far
     # Things here should be static
     return obj
 
+def raw_attr(obj, name):
+    """An attribute, without making a timelined object stop sharing it with a fork."""
+    cow = getattr(obj, "__dict__", {}).get("_cow")
+    if cow and name in cow:
+        return cow[name]
+    return getattr(obj, name, None)
+
 def snapshot(obj, time):
     """The snapshotted form of this object at this time.
 
@@ -408,3 +781,41 @@ if __name__ == "__main__":
     m = k.at(BOTCTime(0,1,0))
 
     print(m)
+
+    # Discarded forks can be freed, along with their entries in the clock's logs
+    import gc, weakref
+    refs = []
+    for i in range(100):
+        f = k.fork()
+        f.append(i)
+        f.add_event("fork")
+        refs.append(weakref.ref(f))
+    del f
+    gc.collect()
+    assert not any(ref() for ref in refs)
+    assert all(change.obj is k or change.obj is k[1] for change in C.changes.between())
+    assert len(C.events) == 0
+
+    # Forks share timelined attributes until used, and their states keep referring to the shared one until changed
+    @timelined(ss_attrs=("items",))
+    class Holder(object):
+        def __init__(self, items=()):
+            self.items = list(items)
+    a = Holder([1], clock=C)
+    shared = raw_attr(a, "items")
+    b = a.fork()
+    assert raw_attr(b, "items") is shared and shared._shares == 2
+    assert tuple(b.at().items) == (1,)
+    list(b.items) # Forks it, without changing b's history
+    assert b.items is not shared and b.items._rehome is shared
+    assert shared._shares == 1 and shared._pending == 1
+    assert b.at().items is shared.at()
+    t0 = C.now
+    C.tick()
+    a.items.append(2) # b's states still refer to the shared one, so a forks it too
+    assert a.items is not shared and a.items._rehome is None and shared._pending == 1
+    assert tuple(a.at().items) == (1, 2) and tuple(b.at().items) == (1,)
+    b.items.append(3)
+    assert b.items._rehome is None and not shared._pending
+    assert tuple(b.at().items) == (1, 3) and tuple(a.at().items) == (1, 2)
+    assert tuple(b.at(t0).items) == (1,) and tuple(shared) == (1,)